@@ -7,16 +7,125 @@ from Apex3D Data,
 """
 
 from PyQt5 import QtGui, QtWidgets,  QtCore
+import cProfile
+import os
 import sys
 from matplotlib.figure import Figure
 from matplotlib.backend_bases import key_press_handler
+from matplotlib.widgets import LassoSelector, RectangleSelector
+from mpl_toolkits.axes_grid1 import make_axes_locatable
 from matplotlib.backends.backend_qt5agg import (
     FigureCanvasQTAgg as FigureCanvas,
     NavigationToolbar2QT as NavigationToolbar)
 from locale import atof,  atoi,  str as lstr
+import pandas as pd
 
 from Ui_PickApex3D import Ui_PickApex3D
-from processApex3D import CCS_Data
+from processApex3D import CCS_Data, Cancelled
+from cacheApex3D import Apex3D_Cache
+from exportApex3D import export_formats
+from sessionApex3D import session_filter
+from runsApex3D import Apex3D_Runs
+from watchApex3D import Apex3D_Watcher
+
+class LoadThread(QtCore.QThread):
+    """Reads and processes a data file outside of the GUI thread.
+    
+    The result is sent with the loaded signal, errors and cancellation with the
+    failed signal, and progress messages with the progress signal.
+    """
+    progress = QtCore.pyqtSignal(str)
+    loaded = QtCore.pyqtSignal(object, str)
+    failed = QtCore.pyqtSignal(str)
+    cancelled_message = 'Loading cancelled'
+    
+    def __init__(self, csv_file, params, cache, profile=False, parent=None):
+        super().__init__(parent)
+        self.csv_file = csv_file
+        self.params = params
+        self.cache = cache
+        self.profile = profile
+        self.cancelled = False
+        
+    def cancel(self):
+        self.cancelled = True
+        
+    def onProgress(self, fraction, rows):
+        if self.cancelled:
+            raise Cancelled()
+        self.progress.emit('Reading %s: %d%% (%d lines)' % (self.csv_file, fraction * 100, rows))
+        
+    def run(self):
+        data = CCS_Data()
+        if self.profile:
+            data.log.profile = cProfile.Profile()
+            data.log.profile.enable()
+        try:
+            loaded = self.load(data)
+        finally:
+            if self.profile:
+                data.log.profile.disable()
+        if loaded:
+            self.loaded.emit(data, self.csv_file)
+
+    def load(self, data):
+        try:
+            data.read(self.csv_file, cache=self.cache, progress=self.onProgress)
+        except Cancelled:
+            self.failed.emit(self.cancelled_message)
+            return False
+        except Exception:
+            self.failed.emit('Error reading file: ' + self.csv_file)
+            return False
+        if self.cancelled:
+            self.failed.emit(self.cancelled_message)
+            return False
+        self.progress.emit('Processing %s: %d lines' % (self.csv_file, data.rows_read))
+        try:
+            data.process(self.params)
+        except Exception as err:
+            self.failed.emit('Error processing file %s: %s' % (self.csv_file, err))
+            return False
+        if self.cancelled:
+            self.failed.emit(self.cancelled_message)
+            return False
+        return True
+
+class SaveThread(QtCore.QThread):
+    """Writes the processed points outside of the GUI thread, reporting the
+    amount of data written with the progress signal.
+    """
+    progress = QtCore.pyqtSignal(str)
+    saved = QtCore.pyqtSignal(str)
+    failed = QtCore.pyqtSignal(str)
+    
+    def __init__(self, data, table, out_file, parent=None):
+        super().__init__(parent)
+        self.data = data
+        self.table = table
+        self.out_file = out_file
+        self.cancelled = False
+        
+    def cancel(self):
+        self.cancelled = True
+        
+    def onProgress(self, fraction, num_bytes):
+        if self.cancelled:
+            raise Cancelled()
+        self.progress.emit('Saving %s: %d%% (%.1f MB)' % (self.out_file, fraction * 100, num_bytes / 1e6))
+        
+    def run(self):
+        try:
+            record = self.data.writeTable(self.table, self.out_file, progress=self.onProgress)
+        except Cancelled:
+            self.failed.emit('Saving cancelled')
+            return
+        except (IOError, ValueError) as err:
+            self.failed.emit('Unable to write file: ' + str(err))
+            return
+        self.saved.emit('Saved %d points to %s: %.1f MB in %.2f s (%.1f MB/s)' 
+                        % (record['rows'], self.out_file, record['bytes'] / 1e6, record['seconds'],
+                           record['bytes'] / 1e6 / max(record['seconds'], 1e-6)))
 
 class PickApex3D(QtWidgets.QMainWindow, Ui_PickApex3D):
     def __init__(self):
@@ -25,6 +134,19 @@ class PickApex3D(QtWidgets.QMainWindow, Ui_PickApex3D):
         # Set up the user interface from Designer.
         self.setupUi(self)
         self.currentSeries = 1
+        # Parsed data files are kept on disk to speed up reopening.
+        self.cache = Apex3D_Cache()
+        # Runs opened together, the active one being self.data.
+        self.runs = Apex3D_Runs()
+        self.runActions = QtWidgets.QActionGroup(self)
+        self.loadThread = None
+        # Whether the unprocessed runs should be loaded once the current load finishes.
+        self.loadNext = False
+        # Folder watched for new files, polled by watchTimer.
+        self.watcher = None
+        self.watchTimer = QtCore.QTimer(self)
+        self.watchTimer.setInterval(1000)
+        self.watchTimer.timeout.connect(self.pollWatch)
         
         # Set sensible initial values in the UI.
         # These have to be localized, so we must set them here.
@@ -37,6 +159,20 @@ class PickApex3D(QtWidgets.QMainWindow, Ui_PickApex3D):
         
         self.statusbar.showMessage('Ready')
 
+    def closeEvent(self, event):
+        self.stopWatch()
+        # No run is loaded once the window closes. The load and the save in
+        # progress are stopped before their threads are destroyed, a file
+        # partly saved being removed.
+        self.loadNext = False
+        for thread in (getattr(self, 'loadThread', None), getattr(self, 'saveThread', None)):
+            if thread is not None:
+                thread.cancel()
+                thread.wait()
+        # Remove the runs spilled to disk.
+        self.runs.clear()
+        super().closeEvent(event)
+
     # Set up the matplotlib canvas in the display_frame widget
     def makeFigureCanvas(self, frame):
         self.fig = Figure((10.0, 8.0), dpi=50)
@@ -58,6 +194,7 @@ class PickApex3D(QtWidgets.QMainWindow, Ui_PickApex3D):
         ispositiveint.setBottom(0)
         self.NeutralMass.setValidator(ispositivedouble)
         self.MassAccuracy.setValidator(ispositivedouble)
+        self.MinIntensity.setValidator(ispositivedouble)
         self.MinCS.setValidator(ispositiveint)
         self.MaxCS.setValidator(ispositiveint)
         self.Calibration_a.setValidator(isdouble)
@@ -68,24 +205,49 @@ class PickApex3D(QtWidgets.QMainWindow, Ui_PickApex3D):
         self.Gas_mass.setValidator(ispositivedouble)
 
     def setInitialUIvalues(self):
-        self.NeutralMass.setText(lstr(22870))
-        self.MassAccuracy.setText(lstr(200))
-        self.MinCS.setText(lstr(1))
-        self.MaxCS.setText(lstr(50))
-        self.Calibration_a.setText(lstr(231.7))
-        self.Calibration_b.setText(lstr(118.7))
-        self.Calibration_X.setText(lstr(0.6262))
-        self.TransferParam.setText(lstr(1.41))
-        self.PusherDelay.setText(lstr(110))
-        self.Gas_mass.setText(lstr(28))
+        self.setUIvalues(CCS_Data.default_parameters)
+
+    def setUIvalues(self, prm):
+        self.NeutralMass.setText(lstr(prm['M']))
+        self.MassAccuracy.setText(lstr(prm['ppm']))
+        self.MinIntensity.setText(lstr(prm.get('MinIntensity', CCS_Data.default_parameters['MinIntensity'])))
+        self.MinCS.setText(lstr(prm['MinCS']))
+        self.MaxCS.setText(lstr(prm['MaxCS']))
+        self.Calibration_a.setText(lstr(prm['a']))
+        self.Calibration_b.setText(lstr(prm['b']))
+        self.Calibration_X.setText(lstr(prm['X']))
+        self.TransferParam.setText(lstr(prm['C']))
+        self.PusherDelay.setText(lstr(prm['push']))
+        self.Gas_mass.setText(lstr(prm['gas']))
 
     # Connections go here
     def makeConnections(self):
         self.actionLoad_Data_File.triggered.connect(self.openandPlot)
+        self.actionCancel_loading.triggered.connect(self.cancelLoading)
         self.actionSave_processed.triggered.connect(self.storeData)
+        self.actionOpen_session.triggered.connect(self.openSession)
+        self.actionSave_session.triggered.connect(self.saveSession)
+        self.actionClear_cache.triggered.connect(self.clearCache)
+        self.actionExport_timing_log.triggered.connect(self.exportLog)
         self.actionQuit.triggered.connect(self.close)
         self.actionNext_series.triggered.connect(self.nextSeries)
         self.actionPrevious_series.triggered.connect(self.prevSeries)
+        self.actionAutomatic_series.triggered.connect(self.autoSeries)
+        self.actionOpen_runs.triggered.connect(self.openRuns)
+        self.actionOverlay_runs.toggled.connect(self.onOverlayToggled)
+        self.actionLinked_subplots.toggled.connect(self.onLinkedToggled)
+        self.actionMemory_budget.triggered.connect(self.setMemoryBudget)
+        self.actionWatch_folder.toggled.connect(self.onWatchToggled)
+        self.actionCCS_distributions.toggled.connect(self.onDistributionsToggled)
+        self.actionExport_distributions.triggered.connect(self.exportDistributions)
+        self.actionSeries_summary.toggled.connect(self.updateSeriesTable)
+        self.actionLasso_selection.toggled.connect(self.onLassoToggled)
+        self.actionBox_selection.toggled.connect(self.onBoxToggled)
+        # Calibration changes are applied to the loaded data while editing.
+        for field in (self.Calibration_a, self.Calibration_X, self.TransferParam,
+                      self.PusherDelay, self.Gas_mass):
+            field.textEdited.connect(self.recalibrate)
+        self.MinIntensity.textEdited.connect(self.changeThreshold)
         self.canvas.mpl_connect('key_press_event', self.on_key_press)
 
     # Functions for connectSlotsByName() called by Ui from pyuic5
@@ -121,39 +283,281 @@ class PickApex3D(QtWidgets.QMainWindow, Ui_PickApex3D):
         if csv_file == '' :
             self.statusbar.showMessage('Ready')
             return True
-        self.data = CCS_Data()
-        try:
-            self.data.read(csv_file)
-        except:
-            self.statusbar.showMessage('Error reading file: ' + csv_file)
-            return True
-        try:
-            self.data.process(params)
-        except KeyError:
-            self.statusbar.showMessage('Error processing file: ' + csv_file)
-            raise
-        if self.data.num_points() == 0:
+        self.startLoading(csv_file, params, self.onLoaded, self.actionProfile_next_load.isChecked())
+        self.actionProfile_next_load.setChecked(False)
+        return True
+
+    def startLoading(self, csv_file, params, onLoaded, profile=False):
+        """Read and process a file in the background, the result being given to onLoaded.
+        """
+        self.loadThread = LoadThread(csv_file, params, self.cache, profile, self)
+        self.loadThread.progress.connect(self.statusbar.showMessage)
+        self.loadThread.loaded.connect(onLoaded)
+        self.loadThread.failed.connect(self.statusbar.showMessage)
+        self.loadThread.finished.connect(self.onLoadFinished)
+        self.actionLoad_Data_File.setEnabled(False)
+        self.actionCancel_loading.setEnabled(True)
+        self.loadThread.start()
+
+    def cancelLoading(self):
+        for thread in (getattr(self, 'loadThread', None), getattr(self, 'saveThread', None)):
+            if thread is not None:
+                thread.cancel()
+                self.statusbar.showMessage('Cancelling...')
+        self.loadNext = False
+
+    def onLoadFinished(self):
+        self.loadThread = None
+        self.actionLoad_Data_File.setEnabled(True)
+        self.actionCancel_loading.setEnabled(getattr(self, 'saveThread', None) is not None)
+        if self.loadNext:
+            self.loadPendingRuns()
+
+    def onLoaded(self, data, csv_file, view=None):
+        if data.num_points() == 0:
             self.statusbar.showMessage('No matching data points found in:'
             + csv_file)
             return True         
+        if getattr(self, 'data', None) is not None:
+            # Keep the series being edited with the run left.
+            self.data.saveSeries(self.currentSeries)
+            if self.data is not data:
+                self.data.disconnectPlot()
+        self.data = data
+        self.runs.active = csv_file
+        self.runs.put(csv_file, data)
+        self.updateRunsMenu()
+        # The drawing is part of the profiled load.
+        if data.log.profile is not None:
+            data.log.profile.enable()
         self.fig.clear()
         self.currentSeries = 1
-        self.ax  = self.fig.add_subplot(111)
+        shown = self.shownRuns()
+        linked = self.actionLinked_subplots.isChecked()
+        self.ax  = self.fig.add_subplot(1, len(shown) + 1 if linked else 1, 1)
         self.plotLayers = { 'main' : self.data.plot(self.ax),  1 : None }
-        self.fig.canvas.mpl_connect('pick_event', self.onpick)
-        self.canvas.draw()
+        self.plotRuns(shown, linked)
+        if view is not None:
+            # Restore a session: series, current series and axes limits.
+            for series in range(1, max(data.series_members, default=1) + 1):
+                self.plotLayers[series] = None
+            self.data.plotSeries(self.plotLayers, self.ax)
+            self.currentSeries = view['series']
+            self.plotLayers.setdefault(self.currentSeries, None)
+            self.ax.set_xlim(view['xlim'])
+            self.ax.set_ylim(view['ylim'])
+        # The data follows the series being edited, see CCS_Data.setThreshold.
+        self.data.updatePlotSeries(self.currentSeries, self.plotLayers, self.ax)
+        self.distAx = None
+        if self.actionCCS_distributions.isChecked():
+            # Panel sharing the CCS axis of the plot.
+            self.distAx = make_axes_locatable(self.ax).append_axes('right', size='30%', 
+                                                                   pad=0.1, sharey=self.ax)
+            self.updateDistributions()
+        self.fig.canvas.mpl_connect('button_press_event', self.onClick)
+        self.updateSelectionTool()
+        with self.data.log.stage('draw'):
+            self.canvas.draw()
+        if data.log.profile is not None:
+            data.log.profile.disable()
+        data.log.end()
   
         # Make the selectSeries spinBox active and set its initial value as its limits to 
         # sensible values.
         self.selectSeries.setEnabled(True)
         self.selectSeries.setMinimum(1)
-        self.selectSeries.setMaximum(1)
-        self.selectSeries.setValue(1)
+        self.selectSeries.setMaximum(max(key for key in self.plotLayers if isinstance(key, int)))
+        self.selectSeries.setValue(self.currentSeries)
         # Initialize the output values for the series.
         self.updateSeriesTable()
+        self.statusbar.showMessage('Loaded %d points: %s' % (data.num_points(), data.log.summary()))
+        self.loadNext = True
+        self.loadPendingRuns()
+
+    def currentView(self):
+        """State of the display, which onLoaded restores.
+        """
+        return dict(series=self.currentSeries, xlim=self.ax.get_xlim(), ylim=self.ax.get_ylim())
+
+    def openRuns(self):
+        files = QtWidgets.QFileDialog.getOpenFileNames(self, 'Open runs', '/home', '*.csv')[0]
+        for csv_file in files:
+            self.runs.add(csv_file)
+        self.updateRunsMenu()
+        if files and getattr(self, 'data', None) is None and self.loadThread is None:
+            self.activateRun(files[0])
+        elif files:
+            self.loadNext = True
+            self.loadPendingRuns()
+
+    def updateRunsMenu(self):
+        """List the runs at the end of the Runs menu, the active one being checked.
+        """
+        for action in self.runActions.actions():
+            self.runActions.removeAction(action)
+            self.menuRuns.removeAction(action)
+        for name in self.runs.names:
+            action = self.menuRuns.addAction(os.path.basename(name))
+            action.setToolTip(name)
+            action.setCheckable(True)
+            action.setChecked(name == self.runs.active)
+            action.triggered.connect(lambda checked, name=name: self.activateRun(name))
+            self.runActions.addAction(action)
+
+    def activateRun(self, name):
+        """Make a run the one displayed and edited, processing it if needed.
+        """
+        if name == self.runs.active and getattr(self, 'data', None) is not None:
+            return
+        if self.runs.isProcessed(name):
+            view = self.currentView() if hasattr(self, 'ax') else None
+            if view is not None:
+                view['series'] = 1
+            self.runs.active = name
+            self.onLoaded(self.runs.get(name), name, view)
+        elif self.loadThread is None:
+            try:
+                params = self.validate_param()
+            except ValueError:
+                self.statusbar.showMessage('Invalid value for parameters.')
+                return
+            self.startLoading(name, params, self.onLoaded)
+        else:
+            self.statusbar.showMessage('Wait for the current loading to finish.')
+        self.updateRunsMenu()
+
+    def shownRuns(self):
+        """Processed runs drawn with the active one, in the overlay or linked modes.
+        """
+        if not (self.actionOverlay_runs.isChecked() or self.actionLinked_subplots.isChecked()):
+            return []
+        return [name for name in self.runs.names
+                if name != self.runs.active and self.runs.isProcessed(name)]
+
+    def plotRuns(self, shown, linked):
+        """Draw the other runs, under the active one or in subplots sharing its axes.
+        At most density_threshold points, the most intense, are drawn for each run.
+        """
+        for i, name in enumerate(shown):
+            table = self.runs.get(name).data_CCS
+            if len(table) > CCS_Data.density_threshold:
+                table = table.nlargest(CCS_Data.density_threshold, 'inten')
+            label = os.path.basename(name)
+            if linked:
+                ax = self.fig.add_subplot(1, len(shown) + 1, i + 2, sharex=self.ax, sharey=self.ax)
+                ax.scatter(table['z'], table['CCS'], c=table['Log_Intensity'], s=20, cmap='hot_r')
+                ax.set_title(label)
+            else:
+                self.ax.scatter(table['z'], table['CCS'], s=20, color='C%d' % (i % 10),
+                                alpha=0.3, zorder=-1, label=label)
+        if shown:
+            self.ax.set_title(os.path.basename(self.runs.active))
+            if not linked:
+                self.ax.legend(loc='upper left')
+
+    def loadPendingRuns(self):
+        """Process in the background the next run shown but not processed yet.
+        """
+        if self.loadThread is not None or not self.loadNext:
+            return
+        if not (self.actionOverlay_runs.isChecked() or self.actionLinked_subplots.isChecked()):
+            return
+        pending = [name for name in self.runs.names if not self.runs.isProcessed(name)]
+        if not pending:
+            return
+        try:
+            params = self.validate_param()
+        except ValueError:
+            return
+        self.loadNext = False
+        self.startLoading(pending[0], params, self.onRunLoaded)
+        self.loadThread.failed.connect(lambda message, name=pending[0]: self.onRunFailed(name, message))
+
+    def onRunLoaded(self, data, csv_file):
+        self.runs.put(csv_file, data)
+        self.refreshRuns()
+        self.loadNext = True
+
+    def onRunFailed(self, name, message):
+        # A cancelled run is loaded again later, as the runs following it.
+        if message == LoadThread.cancelled_message:
+            return
+        # A run which cannot be loaded is dropped, so that the others are loaded.
+        self.runs.remove(name)
+        self.updateRunsMenu()
+        self.loadNext = True
+
+    def refreshRuns(self):
+        if getattr(self, 'data', None) is not None:
+            self.onLoaded(self.data, self.runs.active, self.currentView())
+
+    def onOverlayToggled(self, checked):
+        # Only one way of showing the runs at a time.
+        if checked:
+            self.actionLinked_subplots.setChecked(False)
+        self.refreshRuns()
+
+    def onLinkedToggled(self, checked):
+        if checked:
+            self.actionOverlay_runs.setChecked(False)
+        self.refreshRuns()
+
+    def setMemoryBudget(self):
+        budget, ok = QtWidgets.QInputDialog.getInt(self, 'Memory budget', 
+                        'Memory for the processed runs (MB):', 
+                        self.runs.max_memory // 1024**2, 1, 1024**2)
+        if ok:
+            self.runs.max_memory = budget * 1024**2
+            self.runs.evict()
  
+    def onWatchToggled(self, checked):
+        if not checked:
+            self.stopWatch()
+            self.statusbar.showMessage('Folder watch stopped')
+            return
+        directory = QtWidgets.QFileDialog.getExistingDirectory(self, 'Watch folder', '/home')
+        try:
+            params = self.validate_param()
+        except ValueError:
+            self.statusbar.showMessage('Invalid parameters, folder not watched.')
+            directory = ''
+        if directory == '':
+            self.actionWatch_folder.setChecked(False)
+            return
+        try:
+            self.watcher = Apex3D_Watcher(directory, params)
+        except (IOError, ValueError) as err:
+            self.statusbar.showMessage('Unable to watch folder: ' + str(err))
+            self.actionWatch_folder.setChecked(False)
+            return
+        self.watchTimer.start()
+        self.statusbar.showMessage('Watching %s, results in %s' % (directory, self.watcher.output_dir))
+
+    def pollWatch(self):
+        """Add the files processed by the folder watch to the runs.
+        """
+        rows = self.watcher.poll()
+        for row in rows:
+            if row['status'] == 'OK':
+                self.runs.add(row['file'])
+        if rows:
+            self.updateRunsMenu()
+            self.statusbar.showMessage('Watch: %s: %s (%s)' 
+                                       % (rows[-1]['file'], rows[-1]['status'], self.watcher.status()))
+
+    def stopWatch(self):
+        self.watchTimer.stop()
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
     def storeData(self):
-        csv_file_list = QtWidgets.QFileDialog.getSaveFileName(self, 'Store result in"', '/home', '*.csv')
+        if getattr(self, 'data', None) is None:
+            self.statusbar.showMessage('No data loaded.')
+            return True
+        filters = list(export_formats.values())
+        csv_file_list = QtWidgets.QFileDialog.getSaveFileName(self, 'Store result in"', '/home', 
+                                                              ';;'.join(filters))
         if len(csv_file_list) > 2 :
         # Output a warning that we will not handle more than one file.
             self.statusbar.showMessage('Only saving to the first file.')
@@ -161,25 +565,220 @@ class PickApex3D(QtWidgets.QMainWindow, Ui_PickApex3D):
         if csv_file == '' :
             self.statusbar.showMessage('Ready')
             return True
+        # The format is given by the extension, added from the chosen filter if missing.
+        if '.' not in os.path.basename(csv_file) and csv_file_list[1] in filters:
+            csv_file += '.' + list(export_formats)[filters.index(csv_file_list[1])]
+        self.updateSeries(self.currentSeries)
+        if self.actionSave_series_summary.isChecked():
+            try:
+                self.data.writeTable(self.data.seriesSummary(current=self.currentSeries), 
+                                     self.data.summaryFile(csv_file))
+            except (IOError, ValueError) as err:
+                self.statusbar.showMessage('Unable to write file: ' + str(err))
+                return True
+        table = self.data.exportTable(self.actionSave_series_only.isChecked())
+        # Written in the background, the result is reported in the status bar.
+        self.saveThread = SaveThread(self.data, table, csv_file, self)
+        self.saveThread.progress.connect(self.statusbar.showMessage)
+        self.saveThread.saved.connect(self.statusbar.showMessage)
+        self.saveThread.failed.connect(self.statusbar.showMessage)
+        self.saveThread.finished.connect(self.onSaveFinished)
+        self.actionSave_processed.setEnabled(False)
+        self.actionCancel_loading.setEnabled(True)
+        self.saveThread.start()
+        return True
+
+    def onSaveFinished(self):
+        self.saveThread = None
+        self.actionSave_processed.setEnabled(True)
+        self.actionCancel_loading.setEnabled(getattr(self, 'loadThread', None) is not None)
+        
+    def saveSession(self):
+        if getattr(self, 'data', None) is None:
+            self.statusbar.showMessage('No data loaded.')
+            return True
+        session_file = QtWidgets.QFileDialog.getSaveFileName(self, 'Save session', '/home', 
+                                                             session_filter)[0]
+        if session_file == '' :
+            return True
+        if '.' not in os.path.basename(session_file):
+            session_file += '.apex3d'
         self.updateSeries(self.currentSeries)
+        view = self.currentView()
         try:
-            self.data.save(csv_file)
+            self.data.saveSession(session_file, view)
         except IOError as err:
-            self.statusbar.showMessage('Unable to write file:' + err)
+            self.statusbar.showMessage('Unable to write file: ' + str(err))
             return True
-        self.statusbar.showMessage('Saved to file ' + csv_file)
+        self.statusbar.showMessage('Session saved to ' + session_file)
         return True
-        
-    def onpick(self, event):
-        self.data.toggleSelected(event.ind[0],  self.plotLayers,  self.currentSeries,  self.ax)
+
+    def openSession(self):
+        session_file = QtWidgets.QFileDialog.getOpenFileName(self, 'Open session', '/home', 
+                                                             session_filter)[0]
+        if session_file == '' :
+            return True
+        data = CCS_Data()
+        try:
+            view = data.loadSession(session_file)
+        except (IOError, ValueError, KeyError) as err:
+            self.statusbar.showMessage('Unable to open session: ' + str(err))
+            return True
+        self.setUIvalues(data.parameters)
+        self.onLoaded(data, session_file, view)
+        return True
+
+    def recalibrate(self):
+        if getattr(self, 'data', None) is None or not hasattr(self, 'ax'):
+            return
+        try:
+            params = self.validate_param()
+        except ValueError:
+            # Incomplete value being typed.
+            return
+        try:
+            self.data.recalibrate(params)
+        except ValueError:
+            self.statusbar.showMessage('Protein parameters changed, reload the file to apply them.')
+            return
+        self.updatePlot(rescale=True)
+        self.statusbar.showMessage('Calibration updated')
+
+    def updatePlot(self, rescale):
+        """Show the points of the active run after their values or their number changed.
+        """
+        # Plotted as points or as an intensity map depending on the number of
+        # points, the plot is made again when it crosses density_threshold.
+        if (self.data.num_points() > self.data.density_threshold) != (self.data.view_rows is not None):
+            self.refreshRuns()
+            return
+        self.data.updatePlot(self.currentSeries, self.plotLayers, self.ax, rescale)
+        self.updateDistributions()
+        self.updateSeriesTable()
+
+    def changeThreshold(self):
+        if getattr(self, 'data', None) is None or not hasattr(self, 'ax'):
+            return
+        try:
+            threshold = atof(self.MinIntensity.text())
+        except ValueError:
+            # Incomplete value being typed.
+            return
+        self.data.setThreshold(threshold)
+        # The zoom is kept while the threshold is tuned.
+        self.updatePlot(rescale=False)
+        self.statusbar.showMessage('%d points above the intensity threshold' % self.data.num_points())
+
+    def onDistributionsToggled(self, checked):
+        self.refreshRuns()
+
+    def updateDistributions(self):
+        if getattr(self, 'distAx', None) is not None:
+            self.data.plotDistributions(self.distAx)
+
+    def exportDistributions(self):
+        if getattr(self, 'data', None) is None:
+            self.statusbar.showMessage('No data loaded.')
+            return True
+        filters = list(export_formats.values())
+        out_file, chosen = QtWidgets.QFileDialog.getSaveFileName(self, 'Export CCS distributions', 
+                                                                 '/home', ';;'.join(filters))
+        if out_file == '':
+            return True
+        if '.' not in os.path.basename(out_file) and chosen in filters:
+            out_file += '.' + list(export_formats)[filters.index(chosen)]
+        self.updateSeries(self.currentSeries)
+        table = self.data.ccsDistributions(('Series', 'z'))
+        try:
+            self.data.writeTable(table, out_file)
+        except (IOError, ValueError) as err:
+            self.statusbar.showMessage('Unable to write file: ' + str(err))
+            return True
+        self.statusbar.showMessage('CCS distributions exported to ' + out_file)
+        return True
+
+    def exportLog(self):
+        if getattr(self, 'data', None) is None:
+            self.statusbar.showMessage('No data loaded.')
+            return True
+        json_file = QtWidgets.QFileDialog.getSaveFileName(self, 'Export timing log', '/home', '*.json')[0]
+        if json_file == '' :
+            return True
+        try:
+            self.data.log.save(json_file)
+        except IOError as err:
+            self.statusbar.showMessage('Unable to write file: ' + str(err))
+            return True
+        self.statusbar.showMessage('Timing log exported to ' + json_file)
+        return True
+
+    def clearCache(self):
+        self.cache.clear()
+        self.statusbar.showMessage('Cache cleared')
+
+    def onClick(self, event):
+        # Clicks belong to the zoom and pan tools and to the selection tools when active.
+        if event.inaxes is not self.ax or event.button != 1 or self.mpl_toolbar.mode \
+            or getattr(self, 'selector', None) is not None:
+            return
+        point = self.data.nearestPoint(event.x, event.y, self.ax, 
+                                       self.actionPick_most_intense.isChecked())
+        if point is None:
+            return
+        self.data.toggleSelected(point,  self.plotLayers,  self.currentSeries,  self.ax)
         self.updateSeriesTable()
 
+    def onLassoToggled(self, checked):
+        # Only one selection tool at a time.
+        if checked:
+            self.actionBox_selection.setChecked(False)
+        self.updateSelectionTool()
+
+    def onBoxToggled(self, checked):
+        if checked:
+            self.actionLasso_selection.setChecked(False)
+        self.updateSelectionTool()
+
+    def updateSelectionTool(self):
+        """Attach the selection tool chosen in the Action menu to the axes.
+        """
+        if getattr(self, 'selector', None) is not None:
+            self.selector.set_active(False)
+            self.selector.disconnect_events()
+        self.selector = None
+        if not hasattr(self, 'ax'):
+            return
+        if self.actionLasso_selection.isChecked():
+            self.selector = LassoSelector(self.ax, self.onLasso)
+        elif self.actionBox_selection.isChecked():
+            self.selector = RectangleSelector(self.ax, self.onBox)
+
+    def onLasso(self, vertices):
+        self.selectInPath(vertices)
+
+    def onBox(self, eclick, erelease):
+        x0, x1 = eclick.xdata, erelease.xdata
+        y0, y1 = eclick.ydata, erelease.ydata
+        self.selectInPath([(x0, y0), (x1, y0), (x1, y1), (x0, y1)])
+
+    def selectInPath(self, vertices):
+        """Select all the points inside a contour, or deselect them if Ctrl is pressed.
+        """
+        if len(vertices) < 3:
+            return
+        select = not (QtWidgets.QApplication.keyboardModifiers() & QtCore.Qt.ControlModifier)
+        rows = self.data.pointsInPath(vertices)
+        count = self.data.selectPoints(rows, self.plotLayers, self.currentSeries, self.ax, select)
+        self.updateSeriesTable()
+        self.statusbar.showMessage('%d points %s' % (count, 'selected' if select else 'deselected'))
+
     def validate_param(self):
         try:
             prm = dict(a=atof(self.Calibration_a.text()), b=atof(self.Calibration_b.text()),
                        X=atof(self.Calibration_X.text()), C=atof(self.TransferParam.text()),
                        push=atof(self.PusherDelay.text()), gas=atof(self.Gas_mass.text()),
-                       M=atof(self.NeutralMass.text()), ppm=atof(self.MassAccuracy.text()))
+                       M=atof(self.NeutralMass.text()), ppm=atof(self.MassAccuracy.text()),
+                       MinIntensity=atof(self.MinIntensity.text()))
         except ValueError:
             raise
         if self.MinCS.text == '':
@@ -211,10 +810,16 @@ class PickApex3D(QtWidgets.QMainWindow, Ui_PickApex3D):
         # does not change the series.
         if self.currentSeries != self.selectSeries.value():
             self.selectSeries.setValue(self.currentSeries)
+        self.updateDistributions()
         self.updateSeriesTable()
 
     def updateSeriesTable(self):
+        if getattr(self, 'data', None) is None:
+            return
+        if self.actionSeries_summary.isChecked():
+            return self.updateSummaryTable()
         self.Output_Series.clear()
+        self.Output_Series.horizontalHeader().setVisible(False)
         selectedDataStats = self.data.getSelectedDataStats()
         self.Output_Series.setRowCount(len(selectedDataStats))
         self.Output_Series.setColumnCount(2)
@@ -228,6 +833,44 @@ class PickApex3D(QtWidgets.QMainWindow, Ui_PickApex3D):
             self.Output_Series.setItem(row,  1,  value)
         self.Output_Series.resizeColumnsToContents()
 
+    def updateSummaryTable(self):
+        """Show the statistics of every series, one per row, each one followed by
+        its charge states.
+        """
+        summary = self.data.seriesSummary(current=self.currentSeries)
+        self.Output_Series.clear()
+        self.Output_Series.setRowCount(len(summary))
+        self.Output_Series.setColumnCount(len(summary.columns))
+        self.Output_Series.setHorizontalHeaderLabels(list(summary.columns))
+        self.Output_Series.horizontalHeader().setVisible(True)
+        for row, values in enumerate(summary.itertuples(index=False)):
+            for col, value in enumerate(values):
+                if col == 1 and pd.isna(value):
+                    value = 'All'
+                elif pd.isna(value):
+                    value = 'N/A'
+                else:
+                    value = lstr(value)
+                self.Output_Series.setItem(row, col, QtWidgets.QTableWidgetItem(value))
+        self.Output_Series.resizeColumnsToContents()
+
+    def autoSeries(self):
+        """Replace all the series by those found by clustering, starting again on series 1.
+        """
+        if not hasattr(self, 'ax'):
+            return
+        count = self.data.autoSeries()
+        for series in range(1, count + 1):
+            self.plotLayers.setdefault(series, None)
+        self.data.plotSeries(self.plotLayers, self.ax)
+        self.currentSeries = 1
+        self.data.updatePlotSeries(self.currentSeries, self.plotLayers, self.ax)
+        self.selectSeries.setMaximum(max(count, 1))
+        self.selectSeries.setValue(1)
+        self.updateDistributions()
+        self.updateSeriesTable()
+        self.statusbar.showMessage('%d series found' % count)
+
     def nextSeries(self):
         if self.currentSeries >= self.selectSeries.maximum() :
             self.selectSeries.setMaximum(self.currentSeries+1)
@@ -73,6 +73,12 @@ class Ui_PickApex3D(object):
         self.MaxCS = QtWidgets.QLineEdit(self.layoutWidget)
         self.MaxCS.setObjectName("MaxCS")
         self.gridLayout_Protein.addWidget(self.MaxCS, 1, 3, 1, 1)
+        self.label_14 = QtWidgets.QLabel(self.layoutWidget)
+        self.label_14.setObjectName("label_14")
+        self.gridLayout_Protein.addWidget(self.label_14, 2, 0, 1, 1)
+        self.MinIntensity = QtWidgets.QLineEdit(self.layoutWidget)
+        self.MinIntensity.setObjectName("MinIntensity")
+        self.gridLayout_Protein.addWidget(self.MinIntensity, 2, 1, 1, 1)
         self.verticalLayout_Input.addLayout(self.gridLayout_Protein)
         self.label_6 = QtWidgets.QLabel(self.layoutWidget)
         font = QtGui.QFont()
@@ -164,6 +170,8 @@ class Ui_PickApex3D(object):
         self.menuFile.setObjectName("menuFile")
         self.menuAction = QtWidgets.QMenu(self.menubar)
         self.menuAction.setObjectName("menuAction")
+        self.menuRuns = QtWidgets.QMenu(self.menubar)
+        self.menuRuns.setObjectName("menuRuns")
         PickApex3D.setMenuBar(self.menubar)
         self.statusbar = QtWidgets.QStatusBar(PickApex3D)
         self.statusbar.setObjectName("statusbar")
@@ -175,28 +183,114 @@ class Ui_PickApex3D(object):
         icon = QtGui.QIcon.fromTheme("document-open")
         self.actionLoad_Data_File.setIcon(icon)
         self.actionLoad_Data_File.setObjectName("actionLoad_Data_File")
+        self.actionCancel_loading = QtWidgets.QAction(PickApex3D)
+        self.actionCancel_loading.setEnabled(False)
+        icon = QtGui.QIcon.fromTheme("process-stop")
+        self.actionCancel_loading.setIcon(icon)
+        self.actionCancel_loading.setObjectName("actionCancel_loading")
         self.actionSave_processed = QtWidgets.QAction(PickApex3D)
         icon = QtGui.QIcon.fromTheme("document-save")
         self.actionSave_processed.setIcon(icon)
         self.actionSave_processed.setObjectName("actionSave_processed")
+        self.actionSave_series_only = QtWidgets.QAction(PickApex3D)
+        self.actionSave_series_only.setCheckable(True)
+        self.actionSave_series_only.setObjectName("actionSave_series_only")
+        self.actionOpen_session = QtWidgets.QAction(PickApex3D)
+        self.actionOpen_session.setObjectName("actionOpen_session")
+        self.actionSave_session = QtWidgets.QAction(PickApex3D)
+        self.actionSave_session.setObjectName("actionSave_session")
+        self.actionOpen_runs = QtWidgets.QAction(PickApex3D)
+        self.actionOpen_runs.setObjectName("actionOpen_runs")
+        self.actionOverlay_runs = QtWidgets.QAction(PickApex3D)
+        self.actionOverlay_runs.setCheckable(True)
+        self.actionOverlay_runs.setObjectName("actionOverlay_runs")
+        self.actionLinked_subplots = QtWidgets.QAction(PickApex3D)
+        self.actionLinked_subplots.setCheckable(True)
+        self.actionLinked_subplots.setObjectName("actionLinked_subplots")
+        self.actionMemory_budget = QtWidgets.QAction(PickApex3D)
+        self.actionMemory_budget.setObjectName("actionMemory_budget")
+        self.actionWatch_folder = QtWidgets.QAction(PickApex3D)
+        self.actionWatch_folder.setCheckable(True)
+        self.actionWatch_folder.setObjectName("actionWatch_folder")
+        self.actionExport_distributions = QtWidgets.QAction(PickApex3D)
+        self.actionExport_distributions.setObjectName("actionExport_distributions")
+        self.actionCCS_distributions = QtWidgets.QAction(PickApex3D)
+        self.actionCCS_distributions.setCheckable(True)
+        self.actionCCS_distributions.setObjectName("actionCCS_distributions")
+        self.actionSave_series_summary = QtWidgets.QAction(PickApex3D)
+        self.actionSave_series_summary.setCheckable(True)
+        self.actionSave_series_summary.setObjectName("actionSave_series_summary")
+        self.actionSeries_summary = QtWidgets.QAction(PickApex3D)
+        self.actionSeries_summary.setCheckable(True)
+        self.actionSeries_summary.setObjectName("actionSeries_summary")
+        self.actionClear_cache = QtWidgets.QAction(PickApex3D)
+        self.actionClear_cache.setObjectName("actionClear_cache")
+        self.actionProfile_next_load = QtWidgets.QAction(PickApex3D)
+        self.actionProfile_next_load.setCheckable(True)
+        self.actionProfile_next_load.setObjectName("actionProfile_next_load")
+        self.actionExport_timing_log = QtWidgets.QAction(PickApex3D)
+        self.actionExport_timing_log.setObjectName("actionExport_timing_log")
         self.actionQuit = QtWidgets.QAction(PickApex3D)
         icon = QtGui.QIcon.fromTheme("application-exit")
         self.actionQuit.setIcon(icon)
         self.actionQuit.setObjectName("actionQuit")
         self.actionNext_series = QtWidgets.QAction(PickApex3D)
         self.actionNext_series.setObjectName("actionNext_series")
+        self.actionLasso_selection = QtWidgets.QAction(PickApex3D)
+        self.actionLasso_selection.setCheckable(True)
+        self.actionLasso_selection.setObjectName("actionLasso_selection")
+        self.actionBox_selection = QtWidgets.QAction(PickApex3D)
+        self.actionBox_selection.setCheckable(True)
+        self.actionBox_selection.setObjectName("actionBox_selection")
+        self.actionPick_most_intense = QtWidgets.QAction(PickApex3D)
+        self.actionPick_most_intense.setCheckable(True)
+        self.actionPick_most_intense.setObjectName("actionPick_most_intense")
+        self.actionAutomatic_series = QtWidgets.QAction(PickApex3D)
+        self.actionAutomatic_series.setObjectName("actionAutomatic_series")
         self.actionPrevious_series = QtWidgets.QAction(PickApex3D)
         self.actionPrevious_series.setObjectName("actionPrevious_series")
         self.menuFile.addAction(self.actionLoad_Data_File)
+        self.menuFile.addAction(self.actionCancel_loading)
         self.menuFile.addAction(self.actionSave_processed)
+        self.menuFile.addAction(self.actionSave_series_only)
+        self.menuFile.addAction(self.actionSave_series_summary)
+        self.menuFile.addAction(self.actionExport_distributions)
+        self.menuFile.addSeparator()
+        self.menuFile.addAction(self.actionOpen_session)
+        self.menuFile.addAction(self.actionSave_session)
+        self.menuFile.addSeparator()
+        self.menuFile.addAction(self.actionClear_cache)
+        self.menuFile.addSeparator()
+        self.menuFile.addAction(self.actionProfile_next_load)
+        self.menuFile.addAction(self.actionExport_timing_log)
+        self.menuFile.addSeparator()
         self.menuFile.addAction(self.actionQuit)
         self.menuAction.addAction(self.actionNext_series)
         self.menuAction.addAction(self.actionPrevious_series)
+        self.menuAction.addSeparator()
+        self.menuAction.addAction(self.actionLasso_selection)
+        self.menuAction.addAction(self.actionBox_selection)
+        self.menuAction.addAction(self.actionPick_most_intense)
+        self.menuAction.addSeparator()
+        self.menuAction.addAction(self.actionAutomatic_series)
+        self.menuAction.addSeparator()
+        self.menuAction.addAction(self.actionCCS_distributions)
+        self.menuAction.addAction(self.actionSeries_summary)
+        self.menuRuns.addAction(self.actionOpen_runs)
+        self.menuRuns.addAction(self.actionOverlay_runs)
+        self.menuRuns.addAction(self.actionLinked_subplots)
+        self.menuRuns.addAction(self.actionMemory_budget)
+        self.menuRuns.addAction(self.actionWatch_folder)
+        self.menuRuns.addSeparator()
         self.menubar.addAction(self.menuFile.menuAction())
         self.menubar.addAction(self.menuAction.menuAction())
+        self.menubar.addAction(self.menuRuns.menuAction())
         self.toolBar.addAction(self.actionLoad_Data_File)
+        self.toolBar.addAction(self.actionCancel_loading)
         self.toolBar.addAction(self.actionSave_processed)
         self.toolBar.addSeparator()
+        self.toolBar.addAction(self.actionLasso_selection)
+        self.toolBar.addAction(self.actionBox_selection)
 
         self.retranslateUi(PickApex3D)
         QtCore.QMetaObject.connectSlotsByName(PickApex3D)
@@ -213,6 +307,9 @@ class Ui_PickApex3D(object):
         self.MassAccuracy.setText(_translate("PickApex3D", "200"))
         self.label_5.setText(_translate("PickApex3D", "Maximal charge state"))
         self.MaxCS.setText(_translate("PickApex3D", "50"))
+        self.label_14.setText(_translate("PickApex3D", "Intensity threshold"))
+        self.MinIntensity.setToolTip(_translate("PickApex3D", "Points at or below this intensity are hidden, changes apply at once"))
+        self.MinIntensity.setText(_translate("PickApex3D", "2000"))
         self.label_6.setText(_translate("PickApex3D", "CCS Calibration parameters"))
         self.label_7.setText(_translate("PickApex3D", "a"))
         self.Calibration_a.setText(_translate("PickApex3D", "231.7"))
@@ -229,19 +326,65 @@ class Ui_PickApex3D(object):
         self.label_13.setText(_translate("PickApex3D", "Current series"))
         self.menuFile.setTitle(_translate("PickApex3D", "Fi&le"))
         self.menuAction.setTitle(_translate("PickApex3D", "Action"))
+        self.menuRuns.setTitle(_translate("PickApex3D", "&Runs"))
         self.toolBar.setWindowTitle(_translate("PickApex3D", "toolBar"))
         self.actionLoad_Data_File.setText(_translate("PickApex3D", "&Load Data File"))
         self.actionLoad_Data_File.setToolTip(_translate("PickApex3D", "Load "))
         self.actionLoad_Data_File.setShortcut(_translate("PickApex3D", "Ctrl+O"))
+        self.actionCancel_loading.setText(_translate("PickApex3D", "&Cancel loading"))
+        self.actionCancel_loading.setToolTip(_translate("PickApex3D", "Stop loading the data file"))
+        self.actionCancel_loading.setShortcut(_translate("PickApex3D", "Esc"))
         self.actionSave_processed.setText(_translate("PickApex3D", "&Save processed"))
         self.actionSave_processed.setToolTip(_translate("PickApex3D", "Save the processed data"))
         self.actionSave_processed.setShortcut(_translate("PickApex3D", "Ctrl+S"))
+        self.actionSave_series_only.setText(_translate("PickApex3D", "Save series &only"))
+        self.actionSave_series_only.setToolTip(_translate("PickApex3D", "Only save the points which belong to a series"))
+        self.actionOpen_session.setText(_translate("PickApex3D", "&Open session"))
+        self.actionOpen_session.setToolTip(_translate("PickApex3D", "Resume the work saved in a session file"))
+        self.actionOpen_session.setShortcut(_translate("PickApex3D", "Ctrl+Shift+O"))
+        self.actionSave_session.setText(_translate("PickApex3D", "Save s&ession"))
+        self.actionSave_session.setToolTip(_translate("PickApex3D", "Save the processed points, parameters, series and view to a session file"))
+        self.actionSave_session.setShortcut(_translate("PickApex3D", "Ctrl+Shift+S"))
+        self.actionOpen_runs.setText(_translate("PickApex3D", "&Open runs"))
+        self.actionOpen_runs.setToolTip(_translate("PickApex3D", "Add data files to the runs, processed when first shown"))
+        self.actionOverlay_runs.setText(_translate("PickApex3D", "O&verlay runs"))
+        self.actionOverlay_runs.setToolTip(_translate("PickApex3D", "Draw the other runs under the active one"))
+        self.actionLinked_subplots.setText(_translate("PickApex3D", "&Linked subplots"))
+        self.actionLinked_subplots.setToolTip(_translate("PickApex3D", "Draw the other runs next to the active one, with the same axes limits"))
+        self.actionMemory_budget.setText(_translate("PickApex3D", "&Memory budget..."))
+        self.actionMemory_budget.setToolTip(_translate("PickApex3D", "Memory kept for the processed runs, the others are spilled to disk"))
+        self.actionWatch_folder.setText(_translate("PickApex3D", "&Watch folder..."))
+        self.actionWatch_folder.setToolTip(_translate("PickApex3D", "Process the files written to a folder, and add them to the runs"))
+        self.actionExport_distributions.setText(_translate("PickApex3D", "Export CCS &distributions..."))
+        self.actionExport_distributions.setToolTip(_translate("PickApex3D", "Save the CCS distributions of each series and charge state"))
+        self.actionCCS_distributions.setText(_translate("PickApex3D", "CCS &distributions"))
+        self.actionCCS_distributions.setToolTip(_translate("PickApex3D", "Show the CCS distributions of each charge state and series next to the plot"))
+        self.actionSave_series_summary.setText(_translate("PickApex3D", "Save series s&ummary"))
+        self.actionSave_series_summary.setToolTip(_translate("PickApex3D", "Also save the statistics of all the series, in a file ending with _series"))
+        self.actionSeries_summary.setText(_translate("PickApex3D", "All series s&ummary"))
+        self.actionSeries_summary.setToolTip(_translate("PickApex3D", "Show the statistics of every series and of their charge states"))
+        self.actionClear_cache.setText(_translate("PickApex3D", "&Clear cache"))
+        self.actionClear_cache.setToolTip(_translate("PickApex3D", "Remove the cached copies of the parsed data files"))
+        self.actionProfile_next_load.setText(_translate("PickApex3D", "&Profile next load"))
+        self.actionProfile_next_load.setToolTip(_translate("PickApex3D", "Capture a cProfile of the next file loading"))
+        self.actionExport_timing_log.setText(_translate("PickApex3D", "&Export timing log"))
+        self.actionExport_timing_log.setToolTip(_translate("PickApex3D", "Save the time and memory used by each processing stage"))
         self.actionQuit.setText(_translate("PickApex3D", "&Quit"))
         self.actionQuit.setToolTip(_translate("PickApex3D", "Quit program without saving"))
         self.actionQuit.setShortcut(_translate("PickApex3D", "Ctrl+Q"))
         self.actionNext_series.setText(_translate("PickApex3D", "&Next series"))
         self.actionNext_series.setToolTip(_translate("PickApex3D", "Choose next series"))
         self.actionNext_series.setShortcut(_translate("PickApex3D", "Alt+N"))
+        self.actionLasso_selection.setText(_translate("PickApex3D", "&Lasso selection"))
+        self.actionLasso_selection.setToolTip(_translate("PickApex3D", "Select the points inside a free-hand contour (Ctrl to deselect)"))
+        self.actionLasso_selection.setShortcut(_translate("PickApex3D", "Alt+L"))
+        self.actionBox_selection.setText(_translate("PickApex3D", "&Box selection"))
+        self.actionBox_selection.setToolTip(_translate("PickApex3D", "Select the points inside a rectangle (Ctrl to deselect)"))
+        self.actionBox_selection.setShortcut(_translate("PickApex3D", "Alt+B"))
+        self.actionPick_most_intense.setText(_translate("PickApex3D", "Pick most &intense point"))
+        self.actionPick_most_intense.setToolTip(_translate("PickApex3D", "A click picks the most intense point under the cursor instead of the nearest one"))
+        self.actionAutomatic_series.setText(_translate("PickApex3D", "&Automatic series"))
+        self.actionAutomatic_series.setToolTip(_translate("PickApex3D", "Replace all the series by clusters of points in the (z, CCS) plane"))
         self.actionPrevious_series.setText(_translate("PickApex3D", "&Previous series"))
         self.actionPrevious_series.setToolTip(_translate("PickApex3D", "Select previous series"))
 
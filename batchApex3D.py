@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*- batchApex3D.py
+"""
+@author: Guillaume van der Rest
+Extract relevant points, perform CCS calibration and display result
+from Apex3D Data,
+This is the command-line entry point which processes many files without the GUI
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from exportApex3D import export_formats
+from processApex3D import CCS_Data
+
+# Columns of the summary, one row per file.
+summary_columns = ['file', 'output', 'rows', 'points', 'bytes', 'seconds', 'status',
+                   'read_s', 'extract_s', 'ccs_s', 'save_s']
+
+def read_param(param_file):
+    """Read processing parameters from a json file.
+
+    The file holds the same dictionnary as the one built by the GUI, missing
+    values are taken from CCS_Data.default_parameters.
+
+    Args:
+        param_file (str): Path to the parameter file, None for default values.
+    """
+    prm = dict(CCS_Data.default_parameters)
+    if param_file is not None:
+        with open(param_file) as f:
+            prm.update(json.load(f))
+    for key in ('a', 'b', 'X', 'C', 'push', 'gas', 'M', 'ppm', 'MinIntensity'):
+        prm[key] = float(prm[key])
+    prm['MinCS'] = int(prm['MinCS'])
+    prm['MaxCS'] = int(prm['MaxCS'])
+    if prm['MaxCS'] < prm['MinCS']:
+        prm['MinCS'], prm['MaxCS'] = prm['MaxCS'], prm['MinCS']
+    return prm
+
+def find_files(inputs):
+    """Expand the directories and glob patterns given on the command line into
+    a sorted list of csv files.
+
+    Args:
+        inputs (list of str): Files, directories or glob patterns.
+    """
+    result = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            result.update(glob.glob(os.path.join(item, '*.csv')))
+        else:
+            result.update(glob.glob(item))
+    return sorted(result)
+
+def output_file(csv_file, output_dir, fmt='csv'):
+    """Name of the file in which the processed data of csv_file is saved.
+    """
+    base = os.path.splitext(os.path.basename(csv_file))[0] + '_CCS.' + fmt
+    if output_dir is None:
+        return os.path.join(os.path.dirname(csv_file), base)
+    return os.path.join(output_dir, base)
+
+def process_file(csv_file, parameters, output_dir=None, chunksize=None, fmt='csv', columns=None):
+    """Read, process and save a single file. Runs in the worker processes.
+
+    Returns:
+        A dictionnary describing the outcome, one row of the summary, with the
+        time spent in each stage.
+    """
+    start = time.perf_counter()
+    result = dict(file=csv_file, output='', rows=0, points=0, bytes=0, seconds=0.0, status='OK')
+    data = CCS_Data()
+    try:
+        data.read(csv_file, parameters, chunksize)
+        result['rows'] = data.rows_read
+        data.process(parameters)
+        result['points'] = data.num_points()
+        result['output'] = output_file(csv_file, output_dir, fmt)
+        result['bytes'] = data.save(result['output'], fmt, columns=columns)['bytes']
+    except Exception as err:
+        result['status'] = 'Error: ' + str(err)
+    result['seconds'] = time.perf_counter() - start
+    for record in data.log.records:
+        result[record['stage'] + '_s'] = record['seconds']
+    return result
+
+def run(files, parameters, output_dir=None, jobs=None, chunksize=None, fmt='csv', columns=None):
+    """Process a list of files over a pool of processes.
+
+    Args:
+        files (list of str): csv files to process.
+        parameters (dict): Processing parameters.
+        output_dir (str): Directory for the results, None to write next to the inputs.
+        jobs (int): Number of worker processes, None for the number of CPUs.
+        chunksize (int): Number of lines per chunk for reading, None to read whole files.
+        fmt (str): Format of the results, a key of export_formats.
+        columns (list of str): Columns of the results, all of them if None.
+
+    Returns:
+        The summary as a DataFrame, one row per file.
+    """
+    if jobs == 1:
+        results = [process_file(f, parameters, output_dir, chunksize, fmt, columns) for f in files]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(process_file, files,
+                                    [parameters] * len(files),
+                                    [output_dir] * len(files),
+                                    [chunksize] * len(files),
+                                    [fmt] * len(files),
+                                    [columns] * len(files)))
+    return pd.DataFrame(results, columns=summary_columns)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Process Apex3D files without the GUI.')
+    parser.add_argument('inputs', nargs='+',
+                        help='csv files, directories or glob patterns to process')
+    parser.add_argument('-p', '--parameters',
+                        help='json file with the processing parameters')
+    parser.add_argument('-o', '--output-dir',
+                        help='directory for the results (default: next to the input files)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-c', '--chunksize', type=int, default=None,
+                        help='read files by chunks of this many lines, keeping only '
+                             'the columns and rows needed for processing')
+    parser.add_argument('-f', '--format', choices=list(export_formats), default='csv',
+                        help='format of the results (default: csv)')
+    parser.add_argument('--columns', nargs='+',
+                        help='columns of the results (default: all the columns)')
+    parser.add_argument('-s', '--summary', default='summary.csv',
+                        help='name of the summary file (default: summary.csv)')
+    args = parser.parse_args(argv)
+
+    parameters = read_param(args.parameters)
+    files = find_files(args.inputs)
+    if not files:
+        print('No csv file found.', file=sys.stderr)
+        return 1
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    start = time.perf_counter()
+    summary = run(files, parameters, args.output_dir, args.jobs, args.chunksize,
+                  args.format, args.columns)
+    elapsed = time.perf_counter() - start
+    summary_file = os.path.join(args.output_dir or '.', args.summary)
+    summary.to_csv(summary_file, sep='\t', decimal=',', index=False)
+
+    failed = (summary['status'] != 'OK').sum()
+    rows = summary['rows'].sum()
+    print('Processed %d files (%d failed), %d rows in %.2f s: %.2f files/s, %.0f rows/s'
+          % (len(files), failed, rows, elapsed, len(files) / elapsed, rows / elapsed))
+    print('Wrote %.1f MB of results, %.1f MB/s while saving'
+          % (summary['bytes'].sum() / 1e6, 
+             summary['bytes'].sum() / 1e6 / max(summary['save_s'].sum(), 1e-6)))
+    print('Summary written to ' + summary_file)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
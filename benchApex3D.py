@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*- benchApex3D.py
+"""
+@author: Guillaume van der Rest
+Extract relevant points, perform CCS calibration and display result
+from Apex3D Data,
+This is the benchmark suite, with a generator of synthetic Apex3D files
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from processApex3D import CCS_Data
+
+def make_apex3d(num_rows, csv_file, parameters=None, signal_ratio=0.3, seed=0,
+                chunksize=1000000):
+    """Write a synthetic Apex3D file.
+
+    A fraction signal_ratio of the rows are ions of the protein of mass
+    parameters['M'], with a gaussian charge state envelope and two conformers
+    whose drift times are obtained by inverting the CCS calibration. The other
+    rows are background noise spread over the m/z and drift time ranges.
+
+    Args:
+        num_rows (int): Number of lines of the file.
+        csv_file (str): Path to the file to write.
+        parameters (dict): Processing parameters, CCS_Data.default_parameters if None.
+        signal_ratio (float): Fraction of the rows belonging to the protein.
+        seed (int): Seed of the random generator.
+        chunksize (int): Number of lines generated and written at once.
+    """
+    prm = dict(CCS_Data.default_parameters if parameters is None else parameters)
+    rng = np.random.default_rng(seed)
+    mu = prm['M'] * prm['gas'] / (prm['M'] + prm['gas'])
+    z_center = np.sqrt(prm['M']) / 12
+    header = True
+    with open(csv_file, 'w') as f:
+        for start in range(0, num_rows, chunksize):
+            size = min(chunksize, num_rows - start)
+            num_signal = rng.binomial(size, signal_ratio)
+            num_noise = size - num_signal
+            # Protein ions
+            z = np.clip(np.rint(rng.normal(z_center, z_center / 6, num_signal)),
+                        prm['MinCS'], prm['MaxCS'])
+            mz = (prm['M'] + z * CCS_Data.m_charge_ion) / z
+            mz *= 1 + rng.normal(0, prm['ppm'] / 4e6, num_signal)
+            ccs = np.where(rng.random(num_signal) < 0.7, 1.0, 1.3) * 2.2 * prm['M']**(2/3)
+            ccs *= 1 + rng.normal(0, 0.02, num_signal)
+            rt = (((ccs * np.sqrt(mu) / (prm['a'] * z))**(1 / prm['X'])
+                   + prm['C'] * np.sqrt(mz / 1000)) * 1000 / prm['push'])
+            inten = rng.lognormal(9, 1, num_signal)
+            # Background noise
+            noise_mz = rng.uniform(300, 8000, num_noise)
+            noise_rt = rng.uniform(1, 200, num_noise)
+            noise_inten = rng.lognormal(6.5, 1.2, num_noise)
+            order = rng.permutation(size)
+            chunk = pd.DataFrame({'m_z' : np.concatenate((mz, noise_mz))[order],
+                                  'rt' : np.concatenate((rt, noise_rt))[order],
+                                  'inten' : np.rint(np.concatenate((inten, noise_inten)))[order]})
+            chunk.to_csv(f, index=False, header=header, float_format='%.5f')
+            header = False
+
+def measure(function, repeat):
+    """Time a function and record its peak memory allocation.
+
+    Returns:
+        The best time in seconds over repeat runs and the peak number of bytes
+        allocated during an additional traced run.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def bench_file(csv_file, parameters, repeat=3, num_toggles=200):
+    """Run the benchmarks of all the stages on one file.
+
+    Returns:
+        A list of dictionnaries with the stage, its time and its peak memory.
+    """
+    results = []
+    def record(stage, function, rows, count=1):
+        seconds, peak = measure(function, repeat)
+        results.append(dict(stage=stage, seconds=seconds / count, peak_bytes=peak, rows=rows))
+        print('  %-14s %10.4f s %10.1f MB' % (stage, seconds / count, peak / 1e6))
+
+    data = CCS_Data()
+    data.read(csv_file)
+    num_rows = data.rows_read
+    record('read', lambda: CCS_Data().read(csv_file), num_rows)
+    record('read_chunked',
+           lambda: CCS_Data().read(csv_file, parameters, chunksize=1000000), num_rows)
+    record('process', lambda: data.process(parameters), num_rows)
+    num_points = data.num_points()
+
+    # Interactive stages are run on an off-screen figure.
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    axes = fig.add_subplot(111)
+    layers = {'main' : data.plot(axes), 1 : None}
+    fig.canvas.draw()
+    points = np.random.default_rng(0).integers(0, max(num_points, 1), num_toggles)
+    def toggle():
+        for point in points:
+            data.toggleSelected(point, layers, 1, axes)
+    if num_points:
+        record('toggle', toggle, num_points, num_toggles)
+    record('stats', data.getSelectedDataStats, num_points)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        record('save', lambda: data.save(os.path.join(tmp_dir, 'out.csv')), num_points)
+    return results
+
+def version_label():
+    """Describe the version of the code being benchmarked, from git if available.
+    """
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                    stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run(sizes, data_dir, output, label=None, repeat=3):
+    """Benchmark all the stages for files of the given sizes, generating the
+    files in data_dir when they do not exist yet, and write the results as json.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    parameters = dict(CCS_Data.default_parameters)
+    report = dict(label=label or version_label(),
+                  date=time.strftime('%Y-%m-%d %H:%M:%S'),
+                  python=platform.python_version(), numpy=np.__version__,
+                  pandas=pd.__version__, machine=platform.machine(), results=[])
+    for size in sizes:
+        csv_file = os.path.join(data_dir, 'apex3d_%d.csv' % size)
+        if not os.path.exists(csv_file):
+            print('Generating %s' % csv_file)
+            make_apex3d(size, csv_file, parameters)
+        print('%d rows:' % size)
+        for result in bench_file(csv_file, parameters, repeat):
+            result['size'] = size
+            report['results'].append(result)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('Results written to ' + output)
+
+def compare(reference, current, threshold=1.2):
+    """Print the ratio of times and peak memory between two result files and
+    flag the stages which are slower than threshold times the reference.
+
+    Returns:
+        The number of regressions.
+    """
+    tables = []
+    for result_file in (reference, current):
+        with open(result_file) as f:
+            report = json.load(f)
+        print('%s: %s (%s)' % (result_file, report['label'], report['date']))
+        tables.append(pd.DataFrame(report['results']).set_index(['size', 'stage']))
+    table = tables[0].join(tables[1], how='inner', lsuffix='_ref', rsuffix='_cur')
+    table['time_ratio'] = table['seconds_cur'] / table['seconds_ref']
+    table['memory_ratio'] = table['peak_bytes_cur'] / table['peak_bytes_ref']
+    table['regression'] = table['time_ratio'] > threshold
+    print(table[['seconds_ref', 'seconds_cur', 'time_ratio', 'memory_ratio', 'regression']]
+          .to_string(float_format='%.4g'))
+    return int(table['regression'].sum())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the Apex3D processing.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    gen = commands.add_parser('generate', help='write a synthetic Apex3D file')
+    gen.add_argument('rows', type=float, help='number of lines')
+    gen.add_argument('csv_file', help='file to write')
+    gen.add_argument('--seed', type=int, default=0)
+    bench = commands.add_parser('run', help='run the benchmarks')
+    bench.add_argument('--sizes', type=float, nargs='+', default=[1e4, 1e5, 1e6],
+                       help='number of lines of the benchmark files (default: 1e4 1e5 1e6)')
+    bench.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'PickApex3D_bench'),
+                       help='directory of the generated files')
+    bench.add_argument('--repeat', type=int, default=3, help='runs per stage, the best is kept')
+    bench.add_argument('--label', help='name of this version (default: git describe)')
+    bench.add_argument('-o', '--output', default='bench.json', help='result file')
+    comp = commands.add_parser('compare', help='compare two result files')
+    comp.add_argument('reference')
+    comp.add_argument('current')
+    comp.add_argument('--threshold', type=float, default=1.2,
+                      help='time ratio above which a stage is a regression (default: 1.2)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        make_apex3d(int(args.rows), args.csv_file, seed=args.seed)
+    elif args.command == 'run':
+        run([int(size) for size in args.sizes], args.data_dir, args.output, args.label, args.repeat)
+    else:
+        return 1 if compare(args.reference, args.current, args.threshold) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*- cacheApex3D.py
+"""
+@author: Guillaume van der Rest
+Extract relevant points, perform CCS calibration and display result
+from Apex3D Data,
+This is the on-disk cache of the parsed Apex3D files
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+class Apex3D_Cache(object):
+    """This class stores the columns of parsed Apex3D files as NumPy arrays, so
+    that reopening a file maps them from disk instead of parsing the text again.
+
+    Entries are keyed by the path, size and modification time of the csv file,
+    and the least recently used entries are removed when the cache grows above
+    max_size bytes.
+    """
+    default_directory = os.path.join(os.path.expanduser('~'), '.cache', 'PickApex3D')
+    default_max_size = 4 * 1024**3
+
+    def __init__(self, directory=None, max_size=None):
+        self.directory = directory if directory is not None else self.default_directory
+        self.max_size = max_size if max_size is not None else self.default_max_size
+
+    def key(self, csv_file, variant=''):
+        """Compute the cache key of a file.
+
+        Args:
+            csv_file (str): Path to the csv file.
+            variant (str): Distinguishes between different ways of parsing the same file.
+        """
+        path = os.path.abspath(csv_file)
+        stat = os.stat(path)
+        token = '\n'.join((path, str(stat.st_size), str(stat.st_mtime_ns), variant))
+        return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+    def load(self, csv_file, variant=''):
+        """Map the cached columns of a file.
+
+        Args:
+            csv_file (str): Path to the csv file.
+            variant (str): Distinguishes between different ways of parsing the same file.
+
+        Returns:
+            The cached DataFrame (backed by read-only memory maps), or None if the
+            file is not in the cache.
+        """
+        entry = os.path.join(self.directory, self.key(csv_file, variant))
+        try:
+            with open(os.path.join(entry, 'columns.json')) as meta:
+                columns = json.load(meta)
+            index = np.load(os.path.join(entry, 'index.npy'), mmap_mode='r')
+            data = {col : np.load(os.path.join(entry, '%d.npy' % i), mmap_mode='r')
+                    for i, col in enumerate(columns)}
+        except (OSError, ValueError):
+            return None
+        # Keep track of the use of the entry for eviction.
+        os.utime(entry)
+        return pd.DataFrame(data, index=pd.Index(index), columns=columns, copy=False)
+
+    def store(self, csv_file, data, variant=''):
+        """Write the columns of a parsed file to the cache, then evict old entries
+        if needed. Tables with non numerical columns are not cached.
+
+        Args:
+            csv_file (str): Path to the csv file which was parsed.
+            data (DataFrame): Parsed content of the file.
+            variant (str): Distinguishes between different ways of parsing the same file.
+        """
+        if not all(dtype.kind in 'biuf' for dtype in data.dtypes) \
+            or data.index.dtype.kind not in 'iu':
+            return False
+        key = self.key(csv_file, variant)
+        entry = os.path.join(self.directory, key)
+        # Write to a temporary directory first, so that an interrupted write
+        # never leaves a partial entry behind.
+        tmp_entry = entry + '.tmp%d' % os.getpid()
+        try:
+            os.makedirs(tmp_entry, exist_ok=True)
+            columns = [str(col) for col in data.columns]
+            for i, col in enumerate(data.columns):
+                np.save(os.path.join(tmp_entry, '%d.npy' % i), data[col].to_numpy())
+            np.save(os.path.join(tmp_entry, 'index.npy'), data.index.to_numpy())
+            with open(os.path.join(tmp_entry, 'columns.json'), 'w') as meta:
+                json.dump(columns, meta)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp_entry, entry)
+            self.evict(keep=key)
+        except (OSError, ValueError):
+            # Unwritable or invalid cache directory, the file is just not cached.
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return False
+        return True
+
+    def entries(self):
+        """List the cache entries as (last use, size, path), least recently used first.
+        """
+        result = []
+        if not os.path.isdir(self.directory):
+            return result
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if not os.path.isdir(entry) or '.tmp' in name:
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            result.append((os.path.getmtime(entry), size, entry))
+        return sorted(result)
+
+    def size(self):
+        """Total size of the cache entries in bytes.
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache fits in max_size.
+
+        Args:
+            keep (str): key of an entry which should not be removed.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_size:
+                break
+            if os.path.basename(entry) == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove all the entries from the cache.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*- exportApex3D.py
+"""
+@author: Guillaume van der Rest
+Extract relevant points, perform CCS calibration and display result
+from Apex3D Data,
+This is the export of the processed points to the supported file formats
+"""
+import gzip
+import io
+import os
+import zipfile
+
+import numpy as np
+
+# Supported formats, by file extension.
+export_formats = {'csv' : 'Tab separated text (*.csv)',
+                  'csv.gz' : 'Compressed text (*.csv.gz)',
+                  'npz' : 'NumPy columns (*.npz)'}
+# Number of rows written at once.
+export_chunksize = 100000
+# gzip level of the compressed text, text already shrinks by half at the fastest level.
+compress_level = 1
+
+def export_format(out_file):
+    """Guess the format of a file from its extension, csv by default.
+    """
+    for fmt in sorted(export_formats, key=len, reverse=True):
+        if out_file.lower().endswith('.' + fmt):
+            return fmt
+    return 'csv'
+
+def export_sibling(out_file, suffix):
+    """Name of a file written along with out_file, in the same format, with
+    suffix added to its name before the extension.
+    """
+    fmt = export_format(out_file)
+    if out_file.lower().endswith('.' + fmt):
+        return out_file[:-len(fmt) - 1] + suffix + out_file[-len(fmt) - 1:]
+    return out_file + suffix
+
+def export_table(table, out_file, fmt=None, chunksize=None, progress=None):
+    """Write a table by chunks of rows.
+
+    The csv formats are written as by CCS_Data.save, with tabs and decimal
+    commas. The npz format holds one uncompressed NumPy array per column (and
+    one for the index), which np.load reads back without parsing. A partially
+    written file is removed if an error occurs or progress raises.
+
+    Args:
+        table (DataFrame): Table to write.
+        out_file (str): Path to the file to be written to.
+        fmt (str): Key of export_formats, guessed from out_file if None.
+        chunksize (int): Number of rows per chunk, export_chunksize if None.
+        progress (callable): Called after each chunk with the fraction written
+            and the number of bytes written to the file.
+
+    Returns:
+        The size of the file in bytes.
+    """
+    fmt = fmt or export_format(out_file)
+    if fmt not in export_formats:
+        raise ValueError('Unknown export format: ' + fmt)
+    chunksize = chunksize or export_chunksize
+    try:
+        with open(out_file, 'wb') as raw:
+            if fmt == 'npz':
+                write_npz(table, raw, chunksize, progress)
+            else:
+                write_csv(table, raw, fmt == 'csv.gz', chunksize, progress)
+    except BaseException:
+        if os.path.exists(out_file):
+            os.remove(out_file)
+        raise
+    return os.path.getsize(out_file)
+
+def write_csv(table, raw, compress, chunksize, progress):
+    """Write the rows of table as text to the binary file raw, gzip compressed
+    if compress is True.
+    """
+    stream = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=compress_level) if compress else raw
+    text = io.TextIOWrapper(stream, newline='')
+    for start in range(0, max(len(table), 1), chunksize):
+        table.iloc[start:start + chunksize].to_csv(text, sep='\t', decimal=',',
+                                                   header=(start == 0))
+        text.flush()
+        if progress is not None:
+            progress(min(start + chunksize, len(table)) / max(len(table), 1), raw.tell())
+    # Leave raw open, it is closed by the caller.
+    text.detach()
+    if compress:
+        stream.close()
+
+def write_npz(table, raw, chunksize, progress):
+    """Write the columns of table as .npy members of a zip archive in the binary
+    file raw. Categorical and text columns are stored as unicode strings.
+    """
+    columns = [('index', table.index.to_numpy())]
+    columns += [(str(col), table[col].to_numpy()) for col in table.columns]
+    num_chunks = len(columns) * max(-(-len(table) // chunksize), 1)
+    done = 0
+    with zipfile.ZipFile(raw, 'w', zipfile.ZIP_STORED) as archive:
+        for name, values in columns:
+            if values.dtype.kind == 'O':
+                values = values.astype(str)
+            header = dict(descr=np.lib.format.dtype_to_descr(values.dtype),
+                          fortran_order=False, shape=values.shape)
+            with archive.open(name + '.npy', 'w', force_zip64=True) as member:
+                np.lib.format.write_array_header_2_0(member, header)
+                for start in range(0, max(len(values), 1), chunksize):
+                    member.write(np.ascontiguousarray(values[start:start + chunksize]).tobytes())
+                    done += 1
+                    if progress is not None:
+                        progress(done / num_chunks, raw.tell())
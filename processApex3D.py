@@ -6,57 +6,755 @@ Extract relevant points, perform CCS calibration and display result
 from Apex3D Data,
 This is the Data class which handles data management
 """
+import os
+
 import pandas as pd
 import numpy as np
+from matplotlib import cm as plt_cm
+from matplotlib.path import Path
+
+from exportApex3D import export_sibling, export_table
+from sessionApex3D import read_session, write_session
+from timingApex3D import StageLog
+
+class Cancelled(Exception):
+    """Raised by a progress callback to abort the reading of a file.
+    """
+
+def concat_ranges(starts, counts):
+    """Concatenate the integer ranges [start, start + count) without a Python loop.
+    
+    Args:
+        starts (ndarray): first value of each range.
+        counts (ndarray): length of each range.
+    """
+    offsets = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) - np.repeat(offsets - starts, counts)
+
+def compact_columns(table, dtypes):
+    """Convert the columns of a table in place to compact dtypes.
+    
+    Columns found in dtypes are converted to the given dtype, other floating
+    point columns to float32 and integer columns (and index) to the smallest
+    integer type holding their values.
+    
+    Args:
+        table (DataFrame): Table to convert.
+        dtypes (dict): dtypes of the columns which need a given precision.
+    """
+    for col in table.columns:
+        values = table[col]
+        if col in dtypes:
+            dtype = np.dtype(dtypes[col])
+        elif values.dtype.kind == 'f':
+            dtype = np.dtype(np.float32)
+        elif values.dtype.kind in 'iu' and len(values):
+            dtype = pd.to_numeric(values.iloc[[values.argmin(), values.argmax()]], 
+                                  downcast='integer').dtype
+        else:
+            continue
+        if values.dtype != dtype:
+            table[col] = values.to_numpy().astype(dtype)
+    if table.index.dtype.kind in 'iu' and len(table):
+        index = table.index.to_numpy()
+        dtype = pd.to_numeric(index[[index.argmin(), index.argmax()]], downcast='integer').dtype
+        table.index = pd.Index(index.astype(dtype, copy=False))
+    return table
 
 class CCS_Data(object):
     """This class holds the data loaded from the Apex3D file and performs all 
     the necessary processing.
     """
-    # For now only consider n H+ type ions. This should be fixed in a better way.
-    m_charge_ion = 1.00727645
+    # Masses of the charge carriers, a target may also give the mass of a custom carrier.
+    charge_carriers = {'H+' : 1.00727645, 'Na+' : 22.98922070, 'NH4+' : 18.03382555}
+    # Carrier used when the parameters do not define a table of targets.
+    m_charge_ion = charge_carriers['H+']
+    # Points at or below this intensity are not extracted, whatever the threshold
+    # of the parameters (which only hides the extracted points below it).
+    extraction_floor = 0
+    # Number of lines per chunk when the whole file is read with progress reports.
+    progress_chunksize = 200000
+    # Columns (and their dtypes) kept when reading in chunked mode.
+    read_columns = {'m_z' : np.float64, 'rt' : np.float32, 'inten' : np.float32}
+    # dtypes of the processed columns. Other columns of the file are stored as
+    # float32 or as the smallest integer type holding their values.
+    column_dtypes = dict(read_columns, z=np.int16, Target=np.int16, CCS=np.float32, 
+                         Log_Intensity=np.float32)
+    # Parameters which only affect the conversion to CCS, not the extraction.
+    calibration_keys = ('a', 'X', 'C', 'push', 'gas')
+    # Above this number of points in view, the data is drawn as an intensity map.
+    density_threshold = 20000
+    # Number of CCS bins of the intensity map.
+    density_bins = 256
+    # Distance in pixels within which a click picks a point.
+    pick_radius = 5
+    # Number of CCS values evaluated at once by a calibration sweep.
+    sweep_cells = 10000000
+    # Number of CCS bins of the distributions.
+    distribution_bins = 512
+    # Initial values of the processing parameters.
+    default_parameters = dict(a=231.7, b=118.7, X=0.6262, C=1.41, push=110, gas=28,
+                              M=22870, ppm=200, MinCS=1, MaxCS=50, MinIntensity=2000)
+    
+    def __init__(self):
+        self.data = None
+        # Number of lines parsed from the file by the last read.
+        self.rows_read = 0
+        # Sorted m/z values of self.data, used to cut charge state windows by
+        # binary search instead of masking the whole table.
+        self.mz_index = None
+        # Rendering of the static layers, over which the selection is blitted.
+        self.background = None
+        # Grid of the points in view for picking, see pickIndex.
+        self.pick_index = None
+        # Positions in data_CCS of the points of the pickable scatter, None when
+        # all the points are drawn.
+        self.view_rows = None
+        # Collection of the selected points, see plotSelectedOnTop.
+        self.selection_layer = None
+        # Series being edited in the plot, None if the series are not edited.
+        self.current_series = None
+        # Time and memory used by each stage.
+        self.log = StageLog()
     
-    def read(self, csv_file):
+    def read(self, csv_file, parameters=None, chunksize=None, cache=None, progress=None):
         """Load the data from a csv file.
         
+        If chunksize is given, the file is streamed by chunks of that many lines
+        and only the columns needed for processing are kept. Points below the
+        intensity threshold are dropped while reading, as well as points outside
+        of all the charge state windows when parameters are given.
+        
         Args:
             csv_file (str): Path to the file to be read from.
+            parameters (dict): Processing parameters, used to filter m/z in chunked mode.
+            chunksize (int): Number of lines per chunk, None to read the whole file at once.
+            cache (Apex3D_Cache): Cache of parsed files. Only used when the content
+                read does not depend on parameters.
+            progress (callable): Called after each chunk with the fraction of the file
+                and the number of lines read. It may raise Cancelled to stop reading.
+        """
+        self.log.begin()
+        with self.log.stage('read') as record:
+            if parameters is not None and chunksize is not None:
+                cache = None
+            if chunksize is None:
+                variant = 'full:compact'
+            else:
+                variant = 'chunked:%g' % self.minIntensity(parameters)
+            if cache is not None:
+                self.data = cache.load(csv_file, variant)
+                if self.data is not None:
+                    self.rows_read = len(self.data)
+                    self.sortByMz()
+                    record['rows'] = self.rows_read
+                    return
+            if chunksize is None and progress is None:
+                self.data = pd.read_csv(csv_file, dtype=self.read_columns)
+                self.rows_read = len(self.data)
+            else:
+                self.data = self.readChunked(csv_file, parameters, chunksize, progress)
+            compact_columns(self.data, self.column_dtypes)
+            self.sortByMz()
+            record['rows'] = self.rows_read
+            if cache is not None:
+                try:
+                    cache.store(csv_file, self.data, variant)
+                except (OSError, ValueError):
+                    # Failing to cache the file does not fail the read.
+                    pass
+
+    def readChunked(self, csv_file, parameters, chunksize, progress=None):
+        """Stream the csv file and return only the rows which may be processed.
+        
+        Args:
+            csv_file (str): Path to the file to be read from.
+            parameters (dict): Processing parameters, or None to keep all m/z values.
+            chunksize (int): Number of lines per chunk. If None, the file is read by
+                chunks of progress_chunksize lines and all the rows and columns are kept.
+            progress (callable): Called after each chunk with the fraction of the file
+                and the number of lines read.
+        """
+        prune = chunksize is not None
+        threshold = self.minIntensity(parameters)
+        if prune and parameters is not None:
+            lower, upper = self.mergedWindows(parameters)
+        result_set = []
+        self.rows_read = 0
+        file_size = os.path.getsize(csv_file) or 1
+        with open(csv_file, 'rb') as f:
+            if prune:
+                reader = pd.read_csv(f, usecols=list(self.read_columns), 
+                                     dtype=self.read_columns, chunksize=chunksize)
+            else:
+                reader = pd.read_csv(f, dtype=self.read_columns, chunksize=self.progress_chunksize)
+            for chunk in reader:
+                self.rows_read += len(chunk)
+                if prune:
+                    keep = chunk['inten'].to_numpy() > threshold
+                    if parameters is not None:
+                        mz = chunk['m_z'].to_numpy()
+                        # Last window starting below each m/z value.
+                        pos = np.searchsorted(lower, mz, side='left') - 1
+                        keep &= (pos >= 0) & (mz < upper[np.maximum(pos, 0)])
+                    chunk = chunk[keep]
+                result_set.append(chunk)
+                if progress is not None:
+                    progress(min(f.tell() / file_size, 1.0), self.rows_read)
+        if not result_set:
+            return pd.DataFrame({col : pd.Series(dtype=dtype) 
+                                 for col, dtype in self.read_columns.items()})
+        return pd.concat(result_set)
+
+    def targetTable(self, parameters):
+        """Build the table of the species to extract from the data.
+        
+        parameters['targets'] may hold a list of dictionnaries (or a DataFrame) with
+        the neutral mass 'M', the 'carrier' (a key of charge_carriers or the mass of
+        a custom carrier), the charge range 'MinCS' - 'MaxCS' and an optional 'name'.
+        Missing values are taken from parameters, with H+ as default carrier. Without
+        targets, a single H+ target is built from parameters.
+        
+        Args:
+            parameters (dict): Parameters passed from the UI for processing.
         """
-        self.data = pd.read_csv(csv_file)
+        targets = parameters.get('targets')
+        targets = pd.DataFrame([{}] if targets is None else targets)
+        for key in ('M', 'MinCS', 'MaxCS'):
+            if key not in targets:
+                targets[key] = parameters[key]
+            targets[key] = targets[key].fillna(parameters[key])
+        if 'carrier' not in targets:
+            targets['carrier'] = 'H+'
+        targets['carrier'] = targets['carrier'].fillna('H+')
+        targets['carrier_mass'] = [self.charge_carriers[c] if isinstance(c, str) else float(c) 
+                                   for c in targets['carrier']]
+        targets['carrier'] = [c if isinstance(c, str) else '%g' % c for c in targets['carrier']]
+        if 'name' not in targets:
+            targets['name'] = None
+        targets['name'] = [n if isinstance(n, str) else '%g %s' % (m, c) 
+                           for n, m, c in zip(targets['name'], targets['M'], targets['carrier'])]
+        targets = targets.astype({'M' : float, 'MinCS' : int, 'MaxCS' : int})
+        return targets[['name', 'M', 'carrier', 'carrier_mass', 'MinCS', 'MaxCS']]
 
-    def save(self,  csv_file):
-        """Save data with series to a csv file
+    def chargeWindows(self, parameters):
+        """Compute the m/z window of each charge state of each target.
+        
+        Args:
+            parameters (dict): Parameters passed from the UI for processing.
+            
+        Returns:
+            The table of targets, and the table of windows with the target number,
+            the charge state and the lower and upper m/z bounds (both exclusive).
+        """
+        targets = self.targetTable(parameters)
+        counts = np.maximum(targets['MaxCS'] - targets['MinCS'] + 1, 0).to_numpy()
+        target = np.repeat(np.arange(len(targets)), counts)
+        charges = concat_ranges(targets['MinCS'].to_numpy(), counts)
+        mz = ((targets['M'].to_numpy()[target] 
+               + charges * targets['carrier_mass'].to_numpy()[target]) / charges)
+        windows = pd.DataFrame(dict(Target=target, z=charges,
+                                    mz_min=mz * (1 - parameters['ppm']/1000000),
+                                    mz_max=mz * (1 + parameters['ppm']/1000000)))
+        return targets, windows
+
+    def mergedWindows(self, parameters):
+        """Compute the union of the charge state windows as sorted, disjoint intervals.
+        
+        Args:
+            parameters (dict): Parameters passed from the UI for processing.
+        """
+        targets, windows = self.chargeWindows(parameters)
+        mz_min = windows['mz_min'].to_numpy()
+        mz_max = windows['mz_max'].to_numpy()
+        order = np.argsort(mz_min)
+        lower, upper = [], []
+        for low, up in zip(mz_min[order], mz_max[order]):
+            if upper and low < upper[-1]:
+                upper[-1] = max(upper[-1], up)
+            else:
+                lower.append(low)
+                upper.append(up)
+        return np.array(lower), np.array(upper)
+
+    def minIntensity(self, parameters=None):
+        """Intensity threshold of parameters, points at or below it being
+        considered as noise.
+        """
+        if parameters is None or 'MinIntensity' not in parameters:
+            return self.default_parameters['MinIntensity']
+        return parameters['MinIntensity']
+
+    def sortByMz(self):
+        """Sort the loaded data by m/z (only once) and store the sorted m/z values
+        as an index for the extraction of the charge state windows.
+        """
+        if not self.data['m_z'].is_monotonic_increasing:
+            self.data = self.data.sort_values('m_z', kind='mergesort')
+        self.mz_index = self.data['m_z'].to_numpy()
+
+    def save(self,  csv_file, fmt=None, series_only=False, columns=None, progress=None,
+             summary=False):
+        """Save data with series to a csv file, or to another export format.
         
         Args:
             csf_file (str): Path to the file to be written to.
+            fmt (str): Key of export_formats, guessed from the extension if None.
+            series_only (bool): Only write the points which belong to a series.
+            columns (list of str): Columns to write, all of them if None.
+            progress (callable): Called after each chunk with the fraction written
+                and the number of bytes written.
+            summary (bool): Also write the seriesSummary table, to the file named
+                by summaryFile.
+        """
+        if summary:
+            self.writeTable(self.seriesSummary(), self.summaryFile(csv_file), fmt)
+        return self.writeTable(self.exportTable(series_only, columns), csv_file, fmt, progress)
+
+    def summaryFile(self, csv_file):
+        """Name of the file of the series summary saved along with csv_file.
+        """
+        return export_sibling(csv_file, '_series')
+
+    def exportTable(self, series_only=False, columns=None):
+        """Table of the points to save, with their selection state and series.
+        
+        Args:
+            series_only (bool): Only keep the points which belong to a series.
+            columns (list of str): Columns to keep, all of them if None.
+        """
+        # A shallow copy, which may be written by another thread while the points
+        # are edited, and does not keep the Selected and Series columns in data_CCS.
+        table = self.data_CCS.copy(deep=False)
+        table['Selected'] = self.selected.copy()
+        table['Series'] = self.series.copy()
+        if series_only:
+            table = table[table['Series'].to_numpy() > 0]
+        if columns is not None:
+            table = table[list(columns)]
+        return table
+
+    def writeTable(self, table, out_file, fmt=None, progress=None):
+        """Write a table built by exportTable.
+        
+        Returns:
+            The record of the save stage, with the number of bytes written.
+        """
+        with self.log.stage('save') as record:
+            record['rows'] = len(table)
+            record['bytes'] = export_table(table, out_file, fmt, progress=progress)
+        return record
+
+    def saveSession(self, session_file, view=None):
+        """Save the processed points, the parameters, the series and the selection,
+        so that the work can be resumed with loadSession.
+        
+        Args:
+            session_file (str): Path to the file to be written to.
+            view (dict): State of the display, given back by loadSession.
         """
-        self.data_CCS.to_csv(csv_file, sep='\t', decimal=',')
+        with self.log.stage('session') as record:
+            record['rows'] = len(self.extracted)
+            arrays = {'index' : self.extracted.index.to_numpy(), 
+                      'selected' : self.all_selected, 'series' : self.all_series}
+            categories = {}
+            for col in self.extracted.columns:
+                values = self.extracted[col]
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    categories[col] = values.cat.categories.tolist()
+                    values = values.cat.codes
+                arrays['column:' + col] = values.to_numpy()
+            parameters = dict(self.parameters)
+            if isinstance(parameters.get('targets'), pd.DataFrame):
+                parameters['targets'] = parameters['targets'].to_dict('records')
+            header = dict(columns=[str(col) for col in self.extracted.columns], 
+                          categories=categories, parameters=parameters, 
+                          targets=self.targets.to_dict('records'), 
+                          rows_read=self.rows_read, view=view)
+            write_session(session_file, arrays, header)
+
+    def loadSession(self, session_file):
+        """Load a session written by saveSession. The processed points are mapped
+        from the file rather than read, and can be recalibrated but not processed
+        again since the other lines of the Apex3D file are not kept.
         
+        Args:
+            session_file (str): Path to the file to be read from.
+            
+        Returns:
+            The view given to saveSession.
+        """
+        self.log.begin()
+        with self.log.stage('session') as record:
+            arrays, header = read_session(session_file)
+            columns = {}
+            for col in header['columns']:
+                values = arrays['column:' + col]
+                if col in header['categories']:
+                    values = pd.Categorical.from_codes(values, header['categories'][col])
+                columns[col] = values
+            self.data = None
+            self.mz_index = None
+            self.rows_read = header['rows_read']
+            table = pd.DataFrame(columns, index=pd.Index(arrays['index']), copy=False)
+            self.setExtracted(table)
+            self.targets = pd.DataFrame(header['targets'])
+            self.parameters = header['parameters']
+            self.current_series = None
+            self.resetSelection()
+            self.all_series[:] = arrays['series']
+            self.all_selected[:] = arrays['selected']
+            record['rows'] = len(self.extracted)
+        self.setThreshold(self.minIntensity(self.parameters))
+        return header['view']
+
     def process(self, parameters):
         """Process the data to keep only values which fall within a defined m/z range.
         Directly convert the values to absolute collision cross-sections.
         
+        All the charge states of all the targets (see targetTable) are extracted in
+        a single pass, each point being tagged with its target, carrier, name and
+        charge. The extracted points are kept in the extracted table by decreasing
+        intensity, data_CCS being the part of it above the intensity threshold
+        (see setThreshold).
+        
         Args:
             parameters (dict): Parameters passed from the UI for processing.
         """
         # Stage 1: extract only the lines for which m/z falls within acceptable range
-        result_set = []
-        for i in range(parameters['MinCS'], parameters['MaxCS']+1):
-            mz = (parameters['M'] + i * self.m_charge_ion) / i
-            mz_min = mz * (1 - parameters['ppm']/1000000)
-            mz_max = mz * (1 + parameters['ppm']/1000000)
-            filtered_table = self.data[(self.data['m_z'] > mz_min) & (self.data['m_z'] < mz_max)  & (self.data['inten']>2000)]
-            filtered_table = filtered_table.assign(z = i)
-            result_set.append(filtered_table)
-        fdata = pd.concat(result_set)
-        mu = parameters['M']*parameters['gas']/(parameters['M']+parameters['gas'])
-        self.data_CCS = fdata.assign(CCS = lambda x : (parameters['a'] * 
-                                           (((x['rt'] *
-                                           parameters['push'] / 1000) - 
-                                           parameters['C'] * np.sqrt(x['m_z'] /1000))**parameters['X'])*x['z']/np.sqrt(mu)),
-                         Log_Intensity = lambda x : (np.log10(x['inten'])))
-        self.data_CCS['Selected'] = False
-        self.data_CCS['Series'] = 0
+        with self.log.stage('extract') as record:
+            if self.mz_index is None or len(self.mz_index) != len(self.data):
+                self.sortByMz()
+            self.targets, windows = self.chargeWindows(parameters)
+            # Bounds are exclusive: first value above mz_min, first value not below mz_max.
+            starts = np.searchsorted(self.mz_index, windows['mz_min'].to_numpy(), side='right')
+            stops = np.searchsorted(self.mz_index, windows['mz_max'].to_numpy(), side='left')
+            counts = np.maximum(stops - starts, 0)
+            rows = concat_ranges(starts, counts)
+            window = np.repeat(np.arange(len(windows)), counts)
+            inten = self.data['inten'].to_numpy()[rows]
+            keep = inten > self.extraction_floor
+            order = np.flatnonzero(keep)[np.argsort(-inten[keep], kind='stable')]
+            rows, window = rows[order], window[order]
+            target = windows['Target'].to_numpy()[window]
+            carriers = pd.unique(self.targets['carrier'])
+            carrier_codes = pd.Index(carriers).get_indexer(self.targets['carrier'])
+            names = pd.unique(self.targets['name'])
+            name_codes = pd.Index(names).get_indexer(self.targets['name'])
+            # Built column by column, so that the extracted rows are copied only once.
+            columns = {col : self.data[col].to_numpy()[rows] for col in self.data.columns}
+            columns.update(z=windows['z'].to_numpy()[window], Target=target, 
+                           Carrier=pd.Categorical.from_codes(carrier_codes[target], carriers),
+                           Name=pd.Categorical.from_codes(name_codes[target], names))
+            fdata = pd.DataFrame(columns, index=self.data.index[rows], copy=False)
+            record['rows'] = len(fdata)
+        # Stage 2: convert to CCS
+        with self.log.stage('ccs') as record:
+            fdata['CCS'] = self.computeCCS(fdata, parameters)
+            fdata['Log_Intensity'] = np.log10(fdata['inten'].to_numpy())
+            self.setExtracted(compact_columns(fdata, self.column_dtypes))
+            self.parameters = dict(parameters)
+            self.current_series = None
+            self.resetSelection()
+            record['rows'] = len(self.extracted)
+        self.setThreshold(self.minIntensity(parameters))
+
+    def setExtracted(self, table):
+        """Keep the table of the extracted points, sorted by decreasing intensity,
+        with all of them shown until setThreshold is called.
+        """
+        self.extracted = table
+        # Negated intensities, in increasing order for np.searchsorted.
+        self.neg_inten = -table['inten'].to_numpy()
+        self.data_CCS = table
+
+    def setThreshold(self, threshold):
+        """Show only the extracted points above an intensity threshold.
+        
+        Since the points are sorted by decreasing intensity, the points shown are
+        the first ones of the extracted table and data_CCS is a slice of it,
+        found by binary search. The series of the hidden points are kept, so that
+        they are restored when the threshold is lowered again. The selection of
+        the series being edited is saved before and restored after, other hidden
+        points are deselected.
+        
+        Args:
+            threshold (float): points at or below this intensity are hidden.
+        """
+        with self.log.stage('threshold') as record:
+            if self.current_series is not None:
+                self.saveSeries(self.current_series)
+            count = int(np.searchsorted(self.neg_inten, -threshold, side='left'))
+            self.data_CCS = self.extracted.iloc[:count]
+            self.all_selected[count:] = False
+            self.selected = self.all_selected[:count]
+            self.series = self.all_series[:count]
+            self.selection = set(np.flatnonzero(self.selected).tolist())
+            self.updateSeriesMembers()
+            if self.current_series is not None:
+                self.selection = set(self.series_members.get(self.current_series, set()))
+                self.selected[self.sortedRows(self.selection)] = True
+            self.total_inten = self.data_CCS['inten'].to_numpy(dtype=float).sum()
+            self.updateSelectionSums()
+            self.pick_index = None
+            self.parameters['MinIntensity'] = threshold
+            record['rows'] = count
+
+    def computeCCS(self, data, parameters):
+        """Convert the drift times of extracted points to absolute collision cross-sections.
+        
+        Args:
+            data (DataFrame): Extracted points, with the m_z, rt, z and Target columns.
+            parameters (dict): Parameters passed from the UI for processing.
+        """
+        M = self.targets['M'].to_numpy()[data['Target'].to_numpy()]
+        mu = M*parameters['gas']/(M+parameters['gas'])
+        with np.errstate(invalid='ignore'):
+            return (parameters['a'] * 
+                    (((data['rt'].to_numpy() *
+                    parameters['push'] / 1000) - 
+                    parameters['C'] * np.sqrt(data['m_z'].to_numpy() /1000))**parameters['X'])
+                    *data['z'].to_numpy()/np.sqrt(mu))
+
+    def sameExtraction(self, parameters):
+        """Check whether parameters extract the same points as the last processing,
+        i.e. whether they only differ by calibration parameters.
+        
+        Args:
+            parameters (dict): Parameters passed from the UI for processing.
+        """
+        return (parameters['ppm'] == self.parameters['ppm'] 
+                and self.targetTable(parameters).equals(self.targets))
+
+    def recalibrate(self, parameters):
+        """Recompute the CCS of the extracted points for new calibration parameters,
+        without reading or extracting the data again. Series are kept, and a new
+        intensity threshold is applied.
+        
+        Args:
+            parameters (dict): Parameters passed from the UI for processing.
+            
+        Raises:
+            ValueError: if the parameters change the extraction of the points.
+        """
+        if not self.sameExtraction(parameters):
+            raise ValueError('Extraction parameters changed, the data must be processed again.')
+        with self.log.stage('recalibrate') as record:
+            record['rows'] = len(self.extracted)
+            ccs = self.computeCCS(self.extracted, parameters)
+            self.extracted['CCS'] = ccs.astype(self.column_dtypes['CCS'])
+            self.data_CCS = self.extracted.iloc[:self.num_points()]
+            self.parameters = dict(parameters, MinIntensity=self.parameters['MinIntensity'])
+            self.updateSelectionSums()
+        if self.minIntensity(parameters) != self.parameters['MinIntensity']:
+            self.setThreshold(self.minIntensity(parameters))
+
+    def calibrationGrid(self, **values):
+        """Build the table of calibration parameter points of a sweep, as the
+        cartesian product of the values given for each parameter. The parameters
+        which are not given keep the values of the last processing.
+
+        Args:
+            values: sequences of values, keyed by the names in calibration_keys.
+        """
+        unknown = set(values) - set(self.calibration_keys)
+        if unknown:
+            raise ValueError('Not calibration parameters: ' + ', '.join(sorted(unknown)))
+        axes = [np.atleast_1d(values.get(key, self.parameters[key]))
+                for key in self.calibration_keys]
+        grid = pd.MultiIndex.from_product(axes, names=self.calibration_keys)
+        return grid.to_frame(index=False)
+
+    def calibrationSweep(self, grid, series=None):
+        """Compute the intensity weighted average CCS of the series for many sets
+        of calibration parameters, without processing the data again.
+
+        The CCS of the points of the series are evaluated for a block of parameter
+        points at once, blocks being sized to hold about sweep_cells values.
+        Averages are computed as in the Output_Series table, undefined CCS values
+        counting as zero.
+
+        Args:
+            grid (DataFrame or dict): parameter points, one per row, with columns
+                among calibration_keys (for instance a random sample). A dict is
+                expanded by calibrationGrid. Missing columns keep the values of
+                the last processing.
+            series (list of int): series to average, all the non empty series if None.
+
+        Returns:
+            A DataFrame with the calibration parameters of each point followed by
+            one column of weighted average CCS per series.
+        """
+        if isinstance(grid, dict):
+            grid = self.calibrationGrid(**grid)
+        grid = grid.reset_index(drop=True)
+        for key in self.calibration_keys:
+            if key not in grid:
+                grid[key] = self.parameters[key]
+        if series is None:
+            series = sorted(s for s, members in self.series_members.items() if members)
+        with self.log.stage('sweep') as record:
+            # Points of the series, grouped by series.
+            labels = np.asarray(series, dtype=int)
+            rows = np.flatnonzero(np.isin(self.series, labels))
+            rows = rows[np.argsort(self.series[rows], kind='stable')]
+            present, bounds = np.unique(self.series[rows], return_index=True)
+            columns = pd.Index(labels).get_indexer(present)
+            record['rows'] = len(rows) * len(grid)
+
+            rt = self.data_CCS['rt'].to_numpy()[rows].astype(float)
+            sqrt_mz = np.sqrt(self.data_CCS['m_z'].to_numpy()[rows].astype(float) / 1000)
+            z = self.data_CCS['z'].to_numpy()[rows].astype(float)
+            inten = self.data_CCS['inten'].to_numpy()[rows].astype(float)
+            M = self.targets['M'].to_numpy(dtype=float)[self.data_CCS['Target'].to_numpy()[rows]]
+            total = np.add.reduceat(inten, bounds) if len(rows) else np.zeros(0)
+            total[total == 0] = np.nan
+
+            result = np.full((len(grid), len(labels)), np.nan)
+            prm = {key : grid[key].to_numpy(dtype=float)[:, np.newaxis]
+                   for key in self.calibration_keys}
+            step = max(1, self.sweep_cells // max(len(rows), 1))
+            for start in range(0, len(grid) if len(rows) else 0, step):
+                block = {key : value[start:start + step] for key, value in prm.items()}
+                mu = M * block['gas'] / (M + block['gas'])
+                with np.errstate(invalid='ignore'):
+                    ccs = (block['a'] * (rt * block['push'] / 1000 - block['C'] * sqrt_mz)**block['X']
+                           * z / np.sqrt(mu))
+                weighted = np.add.reduceat(np.nan_to_num(ccs) * inten, bounds, axis=1)
+                result[start:start + step, columns] = weighted / total
+        averages = pd.DataFrame(result, columns=list(labels))
+        return pd.concat([grid[list(self.calibration_keys)], averages], axis=1)
+
+    def ccsDistributions(self, by=('z',), rows=None, bins=None, bandwidth=None):
+        """Compute the intensity weighted CCS distribution of groups of points, as
+        histograms and Gaussian kernel density estimates.
+
+        All the groups are binned on a common CCS grid by a single np.bincount
+        over the points, then smoothed together by FFT with the Gaussian kernel
+        of each group. The cost is one pass over the points plus a few FFTs of
+        the grid per group.
+
+        Args:
+            by (tuple of str): Keys of the groups, 'Series' or columns of data_CCS.
+            rows (array of int): Positions of the points in data_CCS, all of them if None.
+            bins (int): Number of CCS bins, distribution_bins if None.
+            bandwidth (float): Standard deviation of the kernel, in CCS units. If
+                None, it is given for each group by Scott's rule on the intensity
+                weighted CCS, and is at least the range of the group over bins.
+
+        Returns:
+            A DataFrame with one row per group and bin: the keys of the group, the
+            CCS at the centre of the bin, the Intensity of the points in the bin and
+            the Density of intensity per CCS unit estimated by the kernel.
+        """
+        bins = bins or self.distribution_bins
+        by = list(by)
+        with self.log.stage('distribution') as record:
+            ccs = self.data_CCS['CCS'].to_numpy()
+            rows = np.arange(len(ccs)) if rows is None else np.asarray(rows, dtype=int)
+            rows = rows[np.isfinite(ccs[rows])]
+            record['rows'] = len(rows)
+            if not len(rows):
+                return pd.DataFrame(columns=by + ['CCS', 'Intensity', 'Density'])
+            ccs = ccs[rows].astype(float)
+            inten = self.data_CCS['inten'].to_numpy()[rows].astype(float)
+            keys = pd.DataFrame({key : self.series[rows] if key == 'Series' 
+                                 else self.data_CCS[key].to_numpy()[rows] for key in by})
+            if by:
+                grouped = keys.groupby(by, sort=True, observed=True)
+                group = grouped.ngroup().to_numpy()
+                labels = grouped.size().index
+            else:
+                group = np.zeros(len(rows), dtype=int)
+                labels = None
+            num_groups = int(group.max()) + 1
+            if bandwidth is None:
+                total = np.bincount(group, weights=inten, minlength=num_groups)
+                mean = np.bincount(group, weights=inten * ccs, minlength=num_groups) / total
+                var = np.bincount(group, weights=inten * ccs**2, minlength=num_groups) / total - mean**2
+                # Effective number of points of the weighted sample.
+                size = total**2 / np.bincount(group, weights=inten**2, minlength=num_groups)
+                width = 1.06 * np.sqrt(np.maximum(var, 0)) * size**-0.2
+            else:
+                width = np.full(num_groups, float(bandwidth))
+            # Each group is smoothed at least to the resolution of its own range.
+            ends = pd.Series(ccs).groupby(group).agg(['min', 'max'])
+            width = np.maximum(width, (ends['max'] - ends['min']).to_numpy() / bins)
+            # The grid extends 4 kernel widths past the ends of every group, so
+            # that no density is lost at the ends of the CCS range.
+            low = (ends['min'].to_numpy() - 4 * width).min()
+            high = (ends['max'].to_numpy() + 4 * width).max()
+            step = (high - low) / bins or 1.0 / bins
+            cell = np.minimum(((ccs - low) / step).astype(int), bins - 1)
+            hist = np.bincount(group * bins + cell, weights=inten,
+                               minlength=num_groups * bins).reshape(num_groups, bins)
+            # Padding the grid to twice its size keeps the convolution from wrapping around.
+            size = 2 * bins
+            # The kernels are sampled on the grid and normalized, rather than
+            # transformed analytically, so that kernels narrower than a bin
+            # neither ring nor lose intensity. Narrower than step / 8, they fall
+            # in a single bin.
+            offset = step * np.minimum(np.arange(size), size - np.arange(size))
+            kernel = np.exp(-0.5 * (offset / np.maximum(width, step / 8)[:, np.newaxis])**2)
+            kernel /= kernel.sum(axis=1, keepdims=True)
+            density = np.fft.irfft(np.fft.rfft(hist, size, axis=1) * np.fft.rfft(kernel, axis=1), 
+                                   size, axis=1)[:, :bins]
+            density = np.maximum(density, 0) / step
+
+        centres = low + step * (np.arange(bins) + 0.5)
+        table = {key : np.repeat(labels.get_level_values(i), bins) for i, key in enumerate(by)}
+        table.update(CCS=np.tile(centres, num_groups), Intensity=hist.ravel(), 
+                     Density=density.ravel())
+        return pd.DataFrame(table)
+
+    def plotDistributions(self, axes):
+        """Draw the CCS distributions next to the main plot: one curve per charge
+        state, and one thicker curve per series in the color of the series.
+        
+        Args:
+            axes (Matplotlib.Axes): axes sharing the CCS axis of the main plot.
+        """
+        axes.clear()
+        # The curves are cut to the CCS range of the points and leave the
+        # limits of the CCS axis, shared with the main plot, alone.
+        ccs = self.data_CCS['CCS'].to_numpy()
+        ccs = ccs[np.isfinite(ccs)]
+        low, high = (ccs.min(), ccs.max()) if len(ccs) else (0, 0)
+        by_charge = self.ccsDistributions(('z',))
+        charges = by_charge['z'].unique()
+        colors = plt_cm.viridis(np.linspace(0, 1, max(len(charges), 1)))
+        for color, (charge, curve) in zip(colors, by_charge.groupby('z', sort=True)):
+            curve = curve[curve['CCS'].between(low, high)]
+            axes.plot(curve['Density'], curve['CCS'], color=color, linewidth=1, scaley=False)
+        by_series = self.ccsDistributions(('Series',), np.flatnonzero(self.series))
+        for series, curve in by_series.groupby('Series', sort=True):
+            curve = curve[curve['CCS'].between(low, high)]
+            axes.plot(curve['Density'], curve['CCS'], color=self.seriesColor(int(series)), 
+                      linewidth=2, label='Series %d' % series, scaley=False)
+        if len(by_series):
+            axes.legend(loc='upper right', fontsize='small')
+        axes.set_xlabel('Intensity density')
+        axes.tick_params(labelleft=False)
+        axes.set_xlim(left=0)
+        axes.figure.canvas.draw_idle()
+
+    def resetSelection(self):
+        """Clear the selection and the series of all points.
+        
+        The selection state and series membership are kept in arrays and index
+        sets rather than in data_CCS, where the Selected and Series columns are
+        only written when saving. The arrays cover all the extracted points,
+        selected and series being their views on the points shown.
+        """
+        num_points = self.num_points()
+        self.all_selected = np.zeros(len(self.extracted), dtype=bool)
+        self.all_series = np.zeros(len(self.extracted), dtype=np.int16)
+        self.selected = self.all_selected[:num_points]
+        self.series = self.all_series[:num_points]
+        # Positions of the selected points, and of the points of each series.
+        self.selection = set()
+        self.series_members = {}
+        self.updateSelectionSums()
 
     def plot(self, axes):
         """Plot the data on a matplotlib axes.
@@ -64,8 +762,256 @@ class CCS_Data(object):
         Args:
             axes(Matplotlib.Axes): the matplotlib axes on which the data should be drawn.
         """
-        return self.data_CCS.plot.scatter(x='z', y='CCS', c='Log_Intensity', s=50, picker=True, colormap='hot_r', ax=axes)
+        self.background = None
+        self.view_rows = None
+        self.selection_layer = None
+        self.pick_index = None
+        self.disconnectPlot()
+        self.draw_canvas = axes.figure.canvas
+        self.draw_cid = self.draw_canvas.mpl_connect('draw_event', self.onDraw)
+        with self.log.stage('plot') as record:
+            record['rows'] = self.num_points()
+            if self.num_points() > self.density_threshold:
+                return self.plotDensity(axes)
+            result = self.data_CCS.plot.scatter(x='z', y='CCS', c='Log_Intensity', s=50, colormap='hot_r', ax=axes)
+            self.main_scatter = axes.collections[-1]
+            return result
+
+    def disconnectPlot(self):
+        """Stop following the redraws of the canvas of the last plot, when the
+        data is not displayed any more.
+        """
+        if getattr(self, 'draw_canvas', None) is not None:
+            self.draw_canvas.mpl_disconnect(self.draw_cid)
+            self.draw_canvas = None
+        if getattr(self, 'density_timer', None) is not None:
+            self.density_timer.stop()
+            self.density_timer = None
+
+    def updatePlot(self, currentSeries, layers, axes, rescale=True):
+        """Update the plotted points in place, after a recalibration or a change
+        of the intensity threshold.
+        
+        Args:
+            currentSeries (int): series being edited, drawn from the selection.
+            layers (dict of Artists): dictionnary of the series plotted on axes.
+            axes (Matplotlib.Plot.Axes) : axes on which the collections are laid.
+            rescale (bool): fit the CCS axis to the new values, otherwise the
+                view is kept.
+        """
+        z = self.data_CCS['z'].to_numpy()
+        ccs = self.data_CCS['CCS'].to_numpy()
+        if rescale and np.isfinite(ccs).any():
+            margin = 0.05 * (np.nanmax(ccs) - np.nanmin(ccs)) or 1
+            axes.set_ylim(np.nanmin(ccs) - margin, np.nanmax(ccs) + margin)
+        self.pick_index = None
+        if self.view_rows is None:
+            self.main_scatter.set_offsets(np.column_stack((z, ccs)))
+            self.main_scatter.set_array(self.data_CCS['Log_Intensity'].to_numpy())
+        else:
+            self.updateDensityView(axes)
+        for key in layers:
+            if isinstance(key, int) and layers[key] is not None:
+                if key == currentSeries:
+                    rows = self.overlayRows(self.selectedRows(), axes)
+                else:
+                    rows = self.sortedRows(self.series_members.get(key, ()))
+                layers[key].set_offsets(np.column_stack((z[rows], ccs[rows])))
+        axes.figure.canvas.draw_idle()
+
+    def plotDensity(self, axes):
+        """Plot large data sets as an intensity map of (z, CCS), binned for the
+        current view. Individual points are only drawn when the view holds less
+        than density_threshold of them.
+        
+        Args:
+            axes(Matplotlib.Axes): the matplotlib axes on which the data should be drawn.
+        """
+        z = self.data_CCS['z'].to_numpy()
+        ccs = self.data_CCS['CCS'].to_numpy()
+        log_int = self.data_CCS['Log_Intensity'].to_numpy()
+        margin = 0.05 * (np.nanmax(ccs) - np.nanmin(ccs))
+        axes.set_xlim(z.min() - 0.5, z.max() + 0.5)
+        axes.set_ylim(np.nanmin(ccs) - margin, np.nanmax(ccs) + margin)
+        axes.set_autoscale_on(False)
+        axes.set_xlabel('z')
+        axes.set_ylabel('CCS')
+        self.density_image = axes.imshow(np.zeros((1, 1)), origin='lower', aspect='auto', 
+                                         cmap='hot_r', interpolation='nearest')
+        self.view_scatter = axes.scatter(np.zeros(0), np.zeros(0), c=np.zeros(0), s=50, 
+                                         cmap='hot_r')
+        self.view_scatter.set_clim(np.nanmin(log_int), np.nanmax(log_int))
+        self.density_colorbar = axes.figure.colorbar(self.density_image, ax=axes)
+        self.density_colorbar.set_label('Log_Intensity')
+        # Recompute the view once navigation has settled.
+        self.density_timer = axes.figure.canvas.new_timer(interval=100)
+        self.density_timer.single_shot = True
+        self.density_timer.add_callback(self.updateDensityView, axes)
+        axes.callbacks.connect('xlim_changed', self.onViewChanged)
+        axes.callbacks.connect('ylim_changed', self.onViewChanged)
+        self.updateDensityView(axes)
+        return self.density_image
+
+    def onViewChanged(self, axes):
+        if self.density_timer is not None:
+            self.density_timer.start()
+
+    def updateDensityView(self, axes):
+        """Redraw the data in the current view, either as individual points or as
+        an intensity map.
+        
+        Args:
+            axes(Matplotlib.Axes): the matplotlib axes on which the data is drawn.
+        """
+        z = self.data_CCS['z'].to_numpy()
+        ccs = self.data_CCS['CCS'].to_numpy()
+        x0, x1 = sorted(axes.get_xlim())
+        y0, y1 = sorted(axes.get_ylim())
+        in_view = np.flatnonzero((z >= x0) & (z <= x1) & (ccs >= y0) & (ccs <= y1))
+        self.pick_index = None
+        if len(in_view) <= self.density_threshold:
+            self.view_rows = in_view
+            self.view_scatter.set_offsets(np.column_stack((z[in_view], ccs[in_view])))
+            self.view_scatter.set_array(self.data_CCS['Log_Intensity'].to_numpy()[in_view])
+            self.density_colorbar.update_normal(self.view_scatter)
+        else:
+            self.view_rows = in_view[:0]
+            self.view_scatter.set_offsets(np.zeros((0, 2)))
+            self.view_scatter.set_array(np.zeros(0))
+            # One column per charge state.
+            z_edges = np.arange(np.ceil(x0 - 0.5), np.floor(x1 + 0.5) + 1) - 0.5
+            if len(z_edges) < 2:
+                z_edges = np.array([x0, x1])
+            hist, z_edges, ccs_edges = np.histogram2d(z[in_view], ccs[in_view],
+                            bins=(z_edges, np.linspace(y0, y1, self.density_bins + 1)), 
+                            weights=self.data_CCS['inten'].to_numpy()[in_view])
+            self.density_image.set_data(np.ma.log10(np.ma.masked_less_equal(hist.T, 0)))
+            self.density_image.set_extent((z_edges[0], z_edges[-1], ccs_edges[0], ccs_edges[-1]))
+            self.density_image.autoscale()
+            self.density_colorbar.update_normal(self.density_image)
+        self.density_image.set_visible(len(self.view_rows) == 0)
+        if self.selection_layer is not None:
+            rows = self.overlayRows(self.selectedRows(), axes)
+            self.selection_layer.set_offsets(np.column_stack((z[rows], ccs[rows])))
+        axes.figure.canvas.draw_idle()
+
+    def pickIndex(self, axes):
+        """Index of the points drawn in the view of axes, for picking.
+        
+        The points are located in display coordinates, on a grid of cells of
+        pick_radius pixels, and sorted by cell so that the points around a click
+        are found by binary search. The index is only rebuilt when the data, the
+        limits or the size of the axes change.
         
+        Returns:
+            The view it was built for, the sorted cell numbers, the positions in
+            data_CCS and the display coordinates of the points, and the number of
+            cells in a column of the grid.
+        """
+        view = (axes.get_xlim(), axes.get_ylim(), axes.bbox.bounds)
+        if self.pick_index is not None and self.pick_index[0] == view:
+            return self.pick_index
+        z = self.data_CCS['z'].to_numpy()
+        ccs = self.data_CCS['CCS'].to_numpy()
+        rows = np.arange(self.num_points()) if self.view_rows is None else self.view_rows
+        x0, x1 = sorted(view[0])
+        y0, y1 = sorted(view[1])
+        rows = rows[(z[rows] >= x0) & (z[rows] <= x1) & (ccs[rows] >= y0) & (ccs[rows] <= y1)]
+        xy = axes.transData.transform(np.column_stack((z[rows], ccs[rows])))
+        num_y = int(axes.bbox.height // self.pick_radius) + 3
+        cells = self.pickCells(xy[:, 0], xy[:, 1], axes, num_y)
+        order = np.argsort(cells, kind='stable')
+        self.pick_index = (view, cells[order], rows[order], xy[order], num_y)
+        return self.pick_index
+
+    def pickCells(self, x, y, axes, num_y):
+        """Cell numbers of display coordinates in the grid of pickIndex.
+        """
+        cell_x = np.floor((x - axes.bbox.x0) / self.pick_radius).astype(np.int64) + 1
+        cell_y = np.floor((y - axes.bbox.y0) / self.pick_radius).astype(np.int64) + 1
+        return cell_x * num_y + cell_y
+
+    def nearestPoint(self, x, y, axes, most_intense=False):
+        """Find the point drawn under a click.
+        
+        Args:
+            x, y (float): display coordinates of the click, in pixels.
+            axes (Matplotlib.Axes): axes on which the data is drawn.
+            most_intense (bool): pick the most intense point within pick_radius
+                instead of the nearest one.
+            
+        Returns:
+            The position of the point in data_CCS, None if no point is within
+            pick_radius of the click.
+        """
+        _, cells, rows, xy, num_y = self.pickIndex(axes)
+        cell = int(self.pickCells(np.array([x]), np.array([y]), axes, num_y)[0])
+        # The 3 x 3 cells around the click, one column of the grid at a time.
+        starts = np.searchsorted(cells, [cell - num_y - 1, cell - 1, cell + num_y - 1], side='left')
+        stops = np.searchsorted(cells, [cell - num_y + 1, cell + 1, cell + num_y + 1], side='right')
+        candidates = concat_ranges(starts, stops - starts)
+        distance = np.hypot(xy[candidates, 0] - x, xy[candidates, 1] - y)
+        candidates = candidates[distance <= self.pick_radius]
+        if not len(candidates):
+            return None
+        if most_intense:
+            best = np.argmax(self.data_CCS['inten'].to_numpy()[rows[candidates]])
+        else:
+            best = np.argmin(distance[distance <= self.pick_radius])
+        return int(rows[candidates[best]])
+
+    def onDraw(self, event):
+        """After a full redraw of the figure, keep the static layers as background
+        and draw the animated selection on top of them.
+        """
+        for axes in event.canvas.figure.axes:
+            animated = [artist for artist in axes.collections if artist.get_animated()]
+            if animated:
+                self.background = event.canvas.copy_from_bbox(axes.bbox)
+                for artist in animated:
+                    axes.draw_artist(artist)
+
+    def blitSelection(self, axes):
+        """Redraw only the animated selection over the cached background.
+        
+        Args:
+            axes (Matplotlib.Subplot.Axes): axes containing the selection.
+        """
+        canvas = axes.figure.canvas
+        if self.background is None or not canvas.supports_blit:
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.background)
+        for artist in axes.collections:
+            if artist.get_animated():
+                axes.draw_artist(artist)
+        canvas.blit(axes.bbox)
+        
+    def memory_report(self):
+        """Memory used by the loaded and processed data.
+        
+        Returns:
+            A DataFrame with the dtype and the number of bytes of each column of
+            the loaded table (data), of the processed table (extracted) and of the
+            arrays of the selection, with the total in the last row.
+        """
+        items = []
+        for name in ('data', 'extracted'):
+            table = getattr(self, name, None)
+            if table is None:
+                continue
+            usage = table.memory_usage(deep=True)
+            items += [(name, 'Index', str(table.index.dtype), usage['Index'])]
+            items += [(name, col, str(table[col].dtype), usage[col]) for col in table.columns]
+        for name in ('mz_index', 'all_selected', 'all_series'):
+            values = getattr(self, name, None)
+            # mz_index usually is a view of the m_z column of data.
+            if values is not None and (values.base is None or name != 'mz_index'):
+                items.append((name, '', str(values.dtype), values.nbytes))
+        report = pd.DataFrame(items, columns=['table', 'column', 'dtype', 'bytes'])
+        total = pd.DataFrame([('total', '', '', report['bytes'].sum())], columns=report.columns)
+        return pd.concat([report, total], ignore_index=True)
+
     def num_points(self):
         """Returns the number of points in the data set
         """
@@ -82,31 +1028,215 @@ class CCS_Data(object):
             series (int) : currently active series
             axes (Matplotlib.Subplot.Axes): axes containing the collection to be updated.
         """
-        # Do we have an empty set to start with?
-        index = self.data_CCS.index[point]
-        self.data_CCS.loc[index, 'Selected'] = not self.data_CCS.loc[index, 'Selected']
-        if layers[series] is not None :
-            layers[series].remove()
+        point = int(point)
+        if self.selected[point]:
+            self.selection.discard(point)
+        else:
+            self.selection.add(point)
+        self.selected[point] = not self.selected[point]
+        self.updateSelectionSums([point], 1 if self.selected[point] else -1)
         layers[series] = self.plotSelectedOnTop(layers,  series,  axes)
-        axes.figure.canvas.draw_idle()
+        self.blitSelection(axes)
+ 
+    def sortedRows(self, points):
+        """Convert a set of positions in data_CCS to a sorted array.
+        """
+        return np.sort(np.fromiter(points, dtype=np.intp, count=len(points)))
+
+    def pointsInPath(self, vertices):
+        """Find the points lying inside a polygon of the (z, CCS) plane.
+        
+        Args:
+            vertices (array): (n, 2) vertices of the polygon, in data coordinates.
+            
+        Returns:
+            Sorted array of positions in data_CCS.
+        """
+        vertices = np.asarray(vertices, dtype=float)
+        z = self.data_CCS['z'].to_numpy()
+        ccs = self.data_CCS['CCS'].to_numpy()
+        (x0, y0), (x1, y1) = vertices.min(axis=0), vertices.max(axis=0)
+        candidates = np.flatnonzero((z >= x0) & (z <= x1) & (ccs >= y0) & (ccs <= y1))
+        inside = Path(vertices).contains_points(np.column_stack((z[candidates], ccs[candidates])))
+        return candidates[inside]
+
+    def selectPoints(self, rows, layers, series, axes, select=True):
+        """Add (or remove) a batch of points to the selection, with a single update
+        of the statistics and of the drawing.
+        
+        Args:
+            rows (array of int): positions of the points in data_CCS.
+            layers (dict of Artists): a dictionnary of the plots
+            series (int) : currently active series
+            axes (Matplotlib.Subplot.Axes): axes containing the collection to be updated.
+            select (bool): True to add the points to the selection, False to remove them.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        rows = rows[self.selected[rows] != select]
+        self.selected[rows] = select
+        if select:
+            self.selection.update(rows.tolist())
+        else:
+            self.selection.difference_update(rows.tolist())
+        self.updateSelectionSums(rows, 1 if select else -1)
+        layers[series] = self.plotSelectedOnTop(layers,  series,  axes)
+        self.blitSelection(axes)
+        return len(rows)
+
+    def selectedRows(self):
+        """Positions of the selected points in data_CCS, in increasing order.
+        """
+        return np.flatnonzero(self.selected)
+
+    def overlayRows(self, rows, axes):
+        """Points drawn of a selection over the intensity map of a large data set:
+        those in the view, at most density_threshold of them, the most intense
+        being kept. All the points are drawn over a scatter plot.
+        
+        Args:
+            rows (array of int): sorted positions of the points in data_CCS.
+            axes (Matplotlib.Axes): axes on which the data is drawn.
+        """
+        if self.view_rows is None or len(rows) <= self.density_threshold:
+            return rows
+        z = self.data_CCS['z'].to_numpy()
+        ccs = self.data_CCS['CCS'].to_numpy()
+        x0, x1 = sorted(axes.get_xlim())
+        y0, y1 = sorted(axes.get_ylim())
+        rows = rows[(z[rows] >= x0) & (z[rows] <= x1) & (ccs[rows] >= y0) & (ccs[rows] <= y1)]
+        # The points are sorted by decreasing intensity.
+        return rows[:self.density_threshold]
  
     def plotSelectedOnTop(self, layers,  series,  axes):
-        if not (self.data_CCS[self.data_CCS['Selected']]).empty :
-            result = axes.scatter('z',  'CCS',  data=self.data_CCS[self.data_CCS['Selected']], s=50, 
-                        color=(['k','r','g','b','c','m','y'][series % 7]))
-            # Make sure it is on top.  
-            result.set_zorder(len(layers))
-            return result
-        return None
+        """Update the collection of the selected points in place, creating it on
+        first use. It is animated, so that it is blitted over the other layers
+        instead of redrawing the whole figure. Over an intensity map, only the
+        points of overlayRows are drawn.
+        """
+        rows = self.overlayRows(self.selectedRows(), axes)
+        offsets = np.column_stack((self.data_CCS['z'].to_numpy()[rows], 
+                                   self.data_CCS['CCS'].to_numpy()[rows]))
+        result = layers.get(series)
+        if result is None :
+            result = axes.scatter(offsets[:, 0],  offsets[:, 1], s=50, 
+                        color=self.seriesColor(series))
+        else :
+            result.set_offsets(offsets)
+        result.set_animated(True)
+        # Make sure it is on top.  
+        result.set_zorder(len(layers))
+        self.selection_layer = result
+        return result
             
+    def seriesColor(self, series):
+        return ['k','r','g','b','c','m','y'][series % 7]
+
+    def plotSeries(self, layers, axes):
+        """Draw the points of every series of layers as static collections.
+        
+        Args:
+            layers (dict of Artists): dictionnary of the series plotted on axes.
+            axes (Matplotlib.Plot.Axes) : axes on which the collections are laid.
+        """
+        z = self.data_CCS['z'].to_numpy()
+        ccs = self.data_CCS['CCS'].to_numpy()
+        for key in layers:
+            if not isinstance(key, int):
+                continue
+            rows = self.sortedRows(self.series_members.get(key, ()))
+            if layers[key] is None:
+                layers[key] = axes.scatter(z[rows], ccs[rows], s=50, color=self.seriesColor(key))
+            else:
+                layers[key].set_offsets(np.column_stack((z[rows], ccs[rows])))
+            layers[key].set_animated(False)
+            layers[key].set_zorder(key)
+
+    def autoSeries(self, ccs_tolerance=0.01, min_fraction=0.01, min_series=0.01, max_drift=1):
+        """Assign the points to conformer series by density clustering in the (z, CCS) plane.
+        
+        The plane is divided into cells of one charge state by a relative CCS width of
+        ccs_tolerance, weighted by the intensity of their points. Cells weighing more
+        than min_fraction of the heaviest one are dense, and a series is a group of
+        dense cells connected across neighbouring charge states, the CCS being allowed
+        to shift by max_drift cells from one charge state to the next. Series holding
+        less than min_series of the total intensity are dropped. Series are numbered
+        by decreasing intensity, points out of any series get series 0 and the
+        selection is cleared.
+        
+        Returns:
+            The number of series found.
+        """
+        z = self.data_CCS['z'].to_numpy()
+        ccs = self.data_CCS['CCS'].to_numpy()
+        inten = self.data_CCS['inten'].to_numpy(dtype=float)
+        rows = np.flatnonzero(np.isfinite(ccs) & (ccs > 0))
+        labels = np.zeros(len(rows), dtype=np.int32)
+        count = 0
+        if len(rows):
+            z_cell = z[rows].astype(np.int64) - z[rows].min()
+            ccs_cell = np.floor(np.log(ccs[rows]) / np.log1p(ccs_tolerance)).astype(np.int64)
+            ccs_cell -= ccs_cell.min()
+            shape = (z_cell.max() + 1, ccs_cell.max() + 1)
+            cell = z_cell * shape[1] + ccs_cell
+            weight = np.bincount(cell, weights=inten[rows], minlength=shape[0] * shape[1])
+            dense = (weight > min_fraction * weight.max()).reshape(shape)
+            # Connected components of the dense cells, by propagating the smallest
+            # cell number to the neighbours until nothing changes.
+            empty = weight.size
+            component = np.where(dense, np.arange(weight.size).reshape(shape), empty)
+            while True:
+                padded = np.pad(component, ((1, 1), (max_drift, max_drift)), constant_values=empty)
+                neighbours = component
+                for dz in range(3):
+                    for dc in range(2 * max_drift + 1):
+                        neighbours = np.minimum(neighbours, 
+                                        padded[dz:dz + shape[0], dc:dc + shape[1]])
+                neighbours = np.where(dense, neighbours, empty)
+                if np.array_equal(neighbours, component):
+                    break
+                component = neighbours
+            component = component.ravel()
+            ids, cell_component = np.unique(component, return_inverse=True)
+            component_weight = np.bincount(cell_component, weights=weight)
+            component_weight[ids == empty] = 0
+            order = np.argsort(-component_weight, kind='stable')
+            kept = component_weight[order] >= min_series * weight.sum()
+            count = int(kept.sum())
+            series_of_component = np.zeros(len(ids), dtype=np.int32)
+            series_of_component[order[kept]] = np.arange(1, count + 1)
+            labels = series_of_component[cell_component][cell]
+        self.resetSelection()
+        self.series[rows] = labels
+        self.updateSeriesMembers()
+        return count
+
+    def updateSeriesMembers(self):
+        """Rebuild the sets of points of each series from the series array.
+        """
+        order = np.argsort(self.series, kind='stable')
+        count = int(self.series.max()) if len(self.series) else 0
+        bounds = np.searchsorted(self.series[order], np.arange(1, count + 2))
+        self.series_members = {i + 1 : set(order[bounds[i]:bounds[i + 1]].tolist()) 
+                               for i in range(count) if bounds[i + 1] > bounds[i]}
+
     def saveSeries(self,  series):
-        """Sets data_CCS for the selected series to the value series.
+        """Sets the series of the selected points to the value series. Points of
+        the series which are not selected any more are removed from it.
         
         Args:
             series (int): value of the series to update to.
         """
-        self.data_CCS.loc[self.data_CCS['Selected'],'Series'] = series
-        self.data_CCS['Selected'] = False
+        members = self.sortedRows(self.series_members.get(series, ()))
+        self.series[members[~self.selected[members]]] = 0
+        rows = self.selectedRows()
+        previous = self.series[rows]
+        for other in np.unique(previous[(previous != 0) & (previous != series)]):
+            self.series_members[other].difference_update(rows[previous == other].tolist())
+        self.series[rows] = series
+        self.selected[rows] = False
+        self.series_members[series] = self.selection
+        self.selection = set()
+        self.updateSelectionSums()
           
     def updatePlotSeries(self, currentSeries,  layers,  ax):
         """When changing to a new series, we need to update the plot in order to
@@ -118,73 +1248,158 @@ class CCS_Data(object):
             ax (Matplotlib.Plot.Axes) : axes on which the collections are laid.
             
         """
+        self.current_series = currentSeries
         # Start by restoring the selection state.
-        self.data_CCS['Selected'] = False
-        self.data_CCS.loc[self.data_CCS['Series']  == currentSeries,  'Selected'] \
-            = True
+        self.selected[self.selectedRows()] = False
+        self.selection = set(self.series_members.get(currentSeries, set()))
+        self.selected[self.sortedRows(self.selection)] = True
+        self.updateSelectionSums()
         # Set the zorder of all the series except the current one to their default position.
+        # These become part of the static background.
         for keys in layers :
             if layers[keys] is not None :
                 if isinstance(keys,  int)  :
                     layers[keys].set_zorder(keys)
+                    layers[keys].set_animated(False)
                 else :
                     layers[keys].set_zorder(0)
-        if layers[currentSeries] is not None :
-            layers[currentSeries].remove()
         layers[currentSeries] = self.plotSelectedOnTop(layers,  currentSeries,  ax)
         ax.figure.canvas.draw_idle()
             
 # Output_Series table related functions
+    # Running sums over the selected points, so that the statistics do not
+    # require filtering the whole table.
+    sum_labels = ('count', 'inten', 'z', 'CCS', 'z_inten', 'CCS_inten')
+    
+    def selectionSums(self, rows):
+        """Compute the contribution of some points to the selection sums.
+        
+        Args:
+            rows (array of int): positions of the points in data_CCS.
+            
+        Returns:
+            Array of the sums, in the order of sum_labels.
+        """
+        inten = self.data_CCS['inten'].to_numpy()[rows].astype(float)
+        z = self.data_CCS['z'].to_numpy()[rows].astype(float)
+        # As in pandas sums, undefined CCS values are skipped.
+        ccs = np.nan_to_num(self.data_CCS['CCS'].to_numpy()[rows].astype(float))
+        return np.array([len(inten), inten.sum(), z.sum(), ccs.sum(), 
+                         (z * inten).sum(), (ccs * inten).sum()])
+    
+    def updateSelectionSums(self, rows=None, sign=1):
+        """Update the selection sums.
+        
+        Args:
+            rows (array of int): positions of the points which were added (sign = 1)
+                or removed (sign = -1) from the selection. If None, the sums are
+                recomputed from the whole selection.
+            sign (int): 1 or -1.
+        """
+        if rows is None:
+            self.sel_sums = self.selectionSums(self.selectedRows())
+        else:
+            self.sel_sums += sign * self.selectionSums(rows)
+        # Do not let rounding errors accumulate once the selection is empty.
+        if self.sel_sums[0] == 0:
+            self.sel_sums[:] = 0
+    
     # Functions to process data
     def numPtsSel(self, default):
-        return len(self.data_CCS[self.data_CCS['Selected']])
+        return int(self.sel_sums[0])
     
     def totalIntSel(self,  default):
-        return ((self.data_CCS[self.data_CCS['Selected']])['inten']).sum()
+        return self.sel_sums[1]
     
     def ratioIntSel(self,  default):
-        try:
-            result = self.totalIntSel(default) / (self.data_CCS['inten']).sum()
-        except ValueError:
+        if not self.total_inten:
             return default
-        return result * 100
+        return self.totalIntSel(default) / self.total_inten * 100
         
     def averagezSel(self,  default):
         num_pts = self.numPtsSel(default)
         if not num_pts:
             return default
-        return ((self.data_CCS[self.data_CCS['Selected']])['z']).sum() / num_pts
+        return self.sel_sums[2] / num_pts
     
     def averageCCSSel(self,  default):
         num_pts = self.numPtsSel(default)
         if not num_pts:
             return default
-        return ((self.data_CCS[self.data_CCS['Selected']])['CCS']).sum() / num_pts
+        return self.sel_sums[3] / num_pts
     
     def wAvzSel(self,  default):
         total_int = self.totalIntSel(default)
         if not total_int:
             return default
-        return ((self.data_CCS[self.data_CCS['Selected']])['z'] 
-                        * (self.data_CCS[self.data_CCS['Selected']])['inten']).sum()  \
-                        / total_int
+        return self.sel_sums[4] / total_int
     
     def wAvCCSSel(self,  default):
         total_int = self.totalIntSel(default)
         if not total_int:
             return default
-        return ((self.data_CCS[self.data_CCS['Selected']])['CCS'] 
-                        * (self.data_CCS[self.data_CCS['Selected']])['inten']).sum() \
-                        / total_int
+        return self.sel_sums[5] / total_int
                         
+    # Labels of the statistics of a series.
+    stats_labels = ("Number of points", "Total intensity", "Ratio of intensity (%)", 
+                    "Average z", "Average CCS", "Weighted average z", "Weighted average CCS")
+
     def getSelectedDataStats(self):
      # Dictionnary of rows, in the form label : (function, default_val)
-        return ( 
-            ("Number of points",  self.numPtsSel(0)), 
-            ("Total intensity",  self.totalIntSel(0)), 
-            ("Ratio of intensity (%)",  self.ratioIntSel(0)), 
-            ("Average z",  self.averagezSel("N/A")), 
-            ("Average CCS",  self.averageCCSSel("N/A")), 
-            ("Weighted average z", self.wAvzSel("N/A")), 
-            ("Weighted average CCS",  self.wAvCCSSel("N/A"))
-            )
+        return tuple(zip(self.stats_labels, (
+            self.numPtsSel(0), 
+            self.totalIntSel(0), 
+            self.ratioIntSel(0), 
+            self.averagezSel("N/A"), 
+            self.averageCCSSel("N/A"), 
+            self.wAvzSel("N/A"), 
+            self.wAvCCSSel("N/A")
+            )))
+
+    def seriesSummary(self, by_charge=True, current=None):
+        """Compute the statistics of getSelectedDataStats for every series at once,
+        the sums of all the series (and charge states) being computed by a single
+        grouped aggregation. The selection stands for the series being edited.
+        
+        Args:
+            by_charge (bool): Also give the statistics of each charge state of
+                each series, after the row of the series.
+            current (int): Series being edited, current_series if None.
+        
+        Returns:
+            A DataFrame with the Series, z (missing on the rows of whole series) 
+            and the statistics, labelled as in stats_labels. Undefined values are NaN.
+        """
+        with self.log.stage('summary') as record:
+            series = self.series
+            current = current if current is not None else self.current_series
+            if current is not None:
+                series = series.copy()
+                series[series == current] = 0
+                series[self.selectedRows()] = current
+            rows = np.flatnonzero(series)
+            record['rows'] = len(rows)
+            inten = self.data_CCS['inten'].to_numpy()[rows].astype(float)
+            z = self.data_CCS['z'].to_numpy()[rows].astype(float)
+            # As in the selection sums, undefined CCS values are skipped.
+            ccs = np.nan_to_num(self.data_CCS['CCS'].to_numpy()[rows].astype(float))
+            points = pd.DataFrame(dict(zip(self.sum_labels, 
+                                           (np.ones(len(rows)), inten, z, ccs, z * inten, ccs * inten))))
+            points['Series'] = series[rows]
+            points['charge'] = self.data_CCS['z'].to_numpy()[rows]
+            sums = points.groupby(['Series', 'charge'], sort=True).sum()
+            # Series sums, from the few rows of the charge state sums.
+            table = sums.groupby(level='Series').sum().reset_index()
+            table['charge'] = np.nan
+            if by_charge:
+                table = pd.concat([table, sums.reset_index()], ignore_index=True)
+                table = table.sort_values(['Series', 'charge'], na_position='first', kind='stable')
+            with np.errstate(divide='ignore', invalid='ignore'):
+                stats = (table['count'].astype(int), table['inten'], 
+                         table['inten'] / self.total_inten * 100 if self.total_inten else np.nan,
+                         table['z'] / table['count'], table['CCS'] / table['count'],
+                         table['z_inten'] / table['inten'], table['CCS_inten'] / table['inten'])
+            summary = pd.DataFrame(dict(zip(self.stats_labels, stats)))
+            summary.insert(0, 'z', table['charge'].astype('Int16'))
+            summary.insert(0, 'Series', table['Series'].astype(int))
+            return summary.reset_index(drop=True)
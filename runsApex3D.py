@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*- runsApex3D.py
+"""
+@author: Guillaume van der Rest
+Extract relevant points, perform CCS calibration and display result
+from Apex3D Data,
+This is the set of runs opened together, within a memory budget
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from processApex3D import CCS_Data
+
+class Apex3D_Runs(object):
+    """This class holds the runs opened together, each one processed on first use.
+
+    Only the processed points of a run are kept. When their total size grows
+    above max_memory bytes, the least recently used runs are spilled to session
+    files in a temporary directory, from which they are mapped back when used
+    again. The active run, being edited, is never spilled.
+    """
+    default_max_memory = 2 * 1024**3
+
+    def __init__(self, max_memory=None, directory=None):
+        self.max_memory = max_memory if max_memory is not None else self.default_max_memory
+        # Directory of the spilled runs, a temporary one is created if None.
+        self.directory = directory
+        self.own_directory = directory is None
+        # Runs in the order they were added.
+        self.names = []
+        # By run, least recently used first: the CCS_Data when in memory, the
+        # path of its session file when spilled, None when not processed yet.
+        self.runs = OrderedDict()
+        self.active = None
+
+    def add(self, csv_file):
+        """Add a run, without processing it.
+        """
+        if csv_file not in self.runs:
+            self.names.append(csv_file)
+            self.runs[csv_file] = None
+
+    def isProcessed(self, name):
+        return self.runs.get(name) is not None
+
+    def isResident(self, name):
+        return isinstance(self.runs.get(name), CCS_Data)
+
+    def put(self, name, data):
+        """Store the processed data of a run, as its most recently used. The lines
+        of the Apex3D file are dropped, only the processed points are kept.
+        """
+        self.add(name)
+        data.data = None
+        data.mz_index = None
+        self.runs[name] = data
+        self.runs.move_to_end(name)
+        self.evict(keep=name)
+
+    def get(self, name, parameters=None):
+        """Processed data of a run, mapped back if it was spilled.
+
+        Args:
+            name (str): Run, as given to add.
+            parameters (dict): Parameters to process the run with if it was not
+                processed yet. If None, unprocessed runs give None.
+        """
+        entry = self.runs[name]
+        if entry is None:
+            if parameters is None:
+                return None
+            data = CCS_Data()
+            data.read(name)
+            data.process(parameters)
+            self.put(name, data)
+            return data
+        if isinstance(entry, CCS_Data):
+            data = entry
+        else:
+            data = CCS_Data()
+            data.loadSession(entry)
+            self.runs[name] = data
+        self.runs.move_to_end(name)
+        self.evict(keep=name)
+        return data
+
+    def memory(self, name):
+        """Bytes used by a run in memory.
+        """
+        if not self.isResident(name):
+            return 0
+        return int(self.runs[name].memory_report()['bytes'].iloc[-1])
+
+    def evict(self, keep=None):
+        """Spill the least recently used runs until the others fit in max_memory.
+
+        Args:
+            keep (str): run which should not be spilled, besides the active one.
+        """
+        sizes = OrderedDict((name, self.memory(name)) for name in self.runs)
+        total = sum(sizes.values())
+        for name, size in sizes.items():
+            if total <= self.max_memory:
+                break
+            if size and name not in (self.active, keep):
+                self.spill(name)
+                total -= size
+
+    def spill(self, name):
+        """Write a run to a session file and drop it from memory.
+        """
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='PickApex3D-runs-')
+        os.makedirs(self.directory, exist_ok=True)
+        session_file = os.path.join(self.directory,
+                        hashlib.sha1(name.encode('utf-8')).hexdigest() + '.apex3d')
+        self.runs[name].saveSession(session_file)
+        self.runs[name] = session_file
+
+    def remove(self, name):
+        """Forget a run, removing its spilled session if any.
+        """
+        entry = self.runs.pop(name, None)
+        if name in self.names:
+            self.names.remove(name)
+        if isinstance(entry, str) and os.path.exists(entry):
+            os.remove(entry)
+        if self.active == name:
+            self.active = None
+
+    def clear(self):
+        """Forget all the runs.
+        """
+        for name in list(self.runs):
+            self.remove(name)
+        if self.own_directory and self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
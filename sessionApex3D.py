@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*- sessionApex3D.py
+"""
+@author: Guillaume van der Rest
+Extract relevant points, perform CCS calibration and display result
+from Apex3D Data,
+This is the file format of the sessions, which are reopened by mapping them
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+# First bytes of a session file, with the version of the layout. Version 2
+# holds the points sorted by decreasing intensity.
+session_magic = b'PickApex3D session 2\n'
+# Arrays start at multiples of this number of bytes.
+alignment = 64
+# Filter of the file dialogs.
+session_filter = 'PickApex3D session (*.apex3d)'
+
+def write_session(session_file, arrays, header):
+    """Write arrays and a description of them to a session file.
+
+    The file starts with session_magic, followed by the raw content of the
+    arrays, each aligned on alignment bytes, and by a json header giving their
+    dtype, shape and offset along with the content of header. The last 8 bytes
+    hold the offset of the json header. The file is written under a temporary
+    name and renamed once complete.
+
+    Args:
+        session_file (str): Path to the file to be written to.
+        arrays (dict of ndarray): One dimensional arrays, by name.
+        header (dict): Other content of the session, which must be json serializable.
+    """
+    tmp_file = session_file + '.tmp%d' % os.getpid()
+    entries = {}
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(session_magic)
+            for name, values in arrays.items():
+                values = np.ascontiguousarray(values)
+                f.write(b'\0' * (-f.tell() % alignment))
+                entries[name] = dict(dtype=np.lib.format.dtype_to_descr(values.dtype),
+                                     shape=values.shape, offset=f.tell())
+                f.write(values.tobytes())
+            offset = f.tell()
+            f.write(json.dumps(dict(header, arrays=entries)).encode('utf-8'))
+            f.write(struct.pack('<Q', offset))
+        os.replace(tmp_file, session_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+def read_session(session_file):
+    """Map the arrays of a session file.
+
+    Args:
+        session_file (str): Path to the file to be read from.
+
+    Returns:
+        The arrays, as read-only memory maps by name, and the header.
+
+    Raises:
+        ValueError: if the file is not a session file of this version.
+    """
+    with open(session_file, 'rb') as f:
+        magic = f.read(len(session_magic))
+        if magic != session_magic:
+            if magic.startswith(b'PickApex3D session '):
+                raise ValueError('Session of an older version of PickApex3D: ' + session_file)
+            raise ValueError('Not a PickApex3D session: ' + session_file)
+        f.seek(-8, os.SEEK_END)
+        end = f.tell()
+        (offset,) = struct.unpack('<Q', f.read(8))
+        f.seek(offset)
+        header = json.loads(f.read(end - offset).decode('utf-8'))
+    arrays = {}
+    for name, entry in header.pop('arrays').items():
+        dtype = np.dtype(np.lib.format.descr_to_dtype(entry['dtype']))
+        if int(np.prod(entry['shape'])) == 0:
+            arrays[name] = np.zeros(entry['shape'], dtype=dtype)
+        else:
+            arrays[name] = np.memmap(session_file, dtype=dtype, mode='r',
+                                     offset=entry['offset'], shape=tuple(entry['shape']))
+    return arrays, header
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*- timingApex3D.py
+"""
+@author: Guillaume van der Rest
+Extract relevant points, perform CCS calibration and display result
+from Apex3D Data,
+This is the record of the time and memory used by each processing stage
+"""
+import json
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def current_memory():
+    """Resident memory of the process in bytes, 0 if it cannot be obtained.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+class StageLog(object):
+    """This class records the wall time, the number of rows and the change of
+    resident memory of the processing stages.
+
+    Stages run between begin and end belong to a load. The stages run while
+    editing the data are recorded too, but only the last max_records records
+    are kept.
+    """
+    max_records = 1000
+
+    def __init__(self):
+        self.records = deque(maxlen=self.max_records)
+        # Number of the last load, and whether it is still running.
+        self.load = 0
+        self.loading = False
+        # cProfile.Profile of a load, when profiling was requested.
+        self.profile = None
+
+    def begin(self):
+        """Start a new load, the following stages being part of it.
+        """
+        self.load += 1
+        self.loading = True
+
+    def end(self):
+        """End the load, the following stages being interactive.
+        """
+        self.loading = False
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager recording one stage. The record is given to the
+        with block, which may set its number of 'rows'.
+
+        Args:
+            name (str): Name of the stage.
+        """
+        record = dict(stage=name, rows=None, load=self.load if self.loading else None)
+        memory = current_memory()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            record['memory_delta'] = current_memory() - memory
+            self.records.append(record)
+
+    def loadRecords(self):
+        """Records of the last load, all of them if no load was begun.
+        """
+        if not self.load:
+            return list(self.records)
+        return [record for record in self.records if record['load'] == self.load]
+
+    def summary(self):
+        """One line summary of the stages of the last load.
+        """
+        records = self.loadRecords()
+        items = []
+        for record in records:
+            item = '%s %.2f s' % (record['stage'], record['seconds'])
+            if record['rows'] is not None:
+                item += ', %d rows' % record['rows']
+            if record['memory_delta']:
+                item += ', %+.0f MB' % (record['memory_delta'] / 1e6)
+            items.append(item)
+        total = sum(record['seconds'] for record in records)
+        return ' | '.join(items + ['total %.2f s' % total])
+
+    def save(self, json_file):
+        """Export the records as a json file. If a profile was captured, its
+        statistics are written next to it, with the .prof extension.
+
+        Args:
+            json_file (str): Path to the file to be written to.
+        """
+        with open(json_file, 'w') as f:
+            json.dump(list(self.records), f, indent=1)
+        if self.profile is not None:
+            self.profile.dump_stats(os.path.splitext(json_file)[0] + '.prof')
@@ -0,0 +1,283 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*- watchApex3D.py
+"""
+@author: Guillaume van der Rest
+Extract relevant points, perform CCS calibration and display result
+from Apex3D Data,
+This is the watch mode which processes the files as they appear in a directory
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from batchApex3D import find_files, process_file, read_param, summary_columns
+from exportApex3D import export_formats
+
+# Columns of the watch summary: those of the batch summary, with the content
+# hash, size and modification time of the input file.
+watch_columns = summary_columns + ['sha1', 'size', 'mtime_ns']
+
+def file_hash(csv_file, blocksize=1024**2):
+    """SHA-1 of the content of a file. Runs in the worker processes.
+    """
+    digest = hashlib.sha1()
+    with open(csv_file, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class Apex3D_Watcher(object):
+    """This class processes the csv files of a directory as they are written.
+
+    Each call to poll lists the directory. A file is complete once its size and
+    modification time have not changed for settle seconds. Complete files are
+    hashed then processed as by batchApex3D over a pool of jobs processes, and
+    one row per file is appended to the summary of the output directory. Files
+    with the content of a file already processed, by this watch or a previous
+    one writing the same summary, are skipped. Files listed in that summary
+    are not read again unless their size or modification time changed.
+
+    At most max_pending files are handed to the pool at a time. Other complete
+    files wait on disk, in the order they were completed, so that files arriving
+    faster than they are processed do not pile up in memory.
+    """
+    default_settle = 5.0
+    summary_name = 'summary.csv'
+
+    def __init__(self, directory, parameters, output_dir=None, jobs=None, chunksize=None,
+                 fmt='csv', columns=None, settle=None, max_pending=None):
+        # Files are named by absolute paths in the summary, to be recognized by later watches.
+        self.directory = os.path.abspath(directory)
+        self.parameters = parameters
+        # Results are written to a subdirectory by default, away from the watched files.
+        self.output_dir = output_dir if output_dir is not None else os.path.join(self.directory, 'CCS')
+        self.jobs = jobs or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.fmt = fmt
+        self.columns = columns
+        self.settle = settle if settle is not None else self.default_settle
+        self.max_pending = max_pending or self.jobs
+        self.summary_file = os.path.join(self.output_dir, self.summary_name)
+        # Columns of the summary file, those of an existing file being kept.
+        self.summary_header = watch_columns
+        # Files being written: size and mtime, and the time since they are unchanged.
+        self.growing = {}
+        # Complete files waiting for the pool, with their size and mtime.
+        self.waiting = OrderedDict()
+        # Size and mtime of the files handed to the pool, seen again if rewritten.
+        self.handled = {}
+        # Step ('hash' or 'process'), file and content hash of the jobs in the pool.
+        self.pending = {}
+        # File processed, or being processed, by content hash.
+        self.hashes = {}
+        self.counts = dict(processed=0, failed=0, skipped=0)
+        self.pool = None
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.loadSummary()
+
+    def loadSummary(self):
+        """Take the content hashes of the files processed from an existing summary,
+        and the size and modification time of the files processed or skipped.
+        """
+        if not os.path.exists(self.summary_file):
+            return
+        summary = pd.read_csv(self.summary_file, sep='\t', decimal=',', dtype={'sha1' : str})
+        self.summary_header = list(summary.columns)
+        if 'sha1' not in summary:
+            return
+        done = summary[(summary['status'] == 'OK') & summary['sha1'].notna()]
+        self.hashes.update(zip(done['sha1'], done['file']))
+        if 'size' in summary and 'mtime_ns' in summary:
+            seen = summary[(summary['status'] == 'OK') | summary['status'].str.startswith('Skipped')]
+            seen = seen.dropna(subset=['size', 'mtime_ns'])
+            self.handled.update((csv_file, (int(size), int(mtime))) for csv_file, size, mtime
+                                in zip(seen['file'], seen['size'], seen['mtime_ns']))
+
+    def poll(self):
+        """List the directory, collect the jobs done and hand the waiting files
+        to the pool. Never blocks on the jobs.
+
+        Returns:
+            The summary rows of the files done since the last call.
+        """
+        self.scan(time.monotonic())
+        rows = self.collect()
+        self.submit()
+        return rows
+
+    def scan(self, now):
+        """Find the new, rewritten and complete files of the directory.
+        """
+        summary_file = os.path.abspath(self.summary_file)
+        for csv_file in find_files([self.directory]):
+            # Results written to the watched directory are not watched.
+            if os.path.abspath(csv_file) == summary_file or csv_file.endswith('_CCS.csv'):
+                continue
+            try:
+                stat = os.stat(csv_file)
+            except OSError:
+                # Removed or renamed since listed.
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            if self.handled.get(csv_file) == key or self.waiting.get(csv_file) == key:
+                continue
+            self.waiting.pop(csv_file, None)
+            seen = self.growing.get(csv_file)
+            if seen is None or seen[0] != key:
+                self.growing[csv_file] = (key, now)
+            elif now - seen[1] >= self.settle:
+                del self.growing[csv_file]
+                self.waiting[csv_file] = key
+
+    def submit(self):
+        """Hand waiting files to the pool, up to max_pending jobs.
+        """
+        if self.waiting and self.pool is None:
+            # Processes are started rather than forked, which is safe from the GUI.
+            self.pool = ProcessPoolExecutor(max_workers=self.jobs,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        while self.waiting and len(self.pending) < self.max_pending:
+            csv_file, key = self.waiting.popitem(last=False)
+            self.handled[csv_file] = key
+            self.pending[self.pool.submit(file_hash, csv_file)] = ('hash', csv_file, None)
+
+    def collect(self):
+        """Process the files hashed, unless their content was already processed,
+        and record the files processed.
+
+        Returns:
+            The summary rows of the files done.
+        """
+        rows = []
+        for future in [future for future in self.pending if future.done()]:
+            step, csv_file, digest = self.pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as err:
+                # The file could not be read, or the worker died.
+                if digest is not None:
+                    del self.hashes[digest]
+                rows.append(self.record(dict(file=csv_file, status='Error: ' + str(err)), digest))
+                continue
+            if step == 'process':
+                if result['status'] != 'OK':
+                    del self.hashes[digest]
+                rows.append(self.record(result, digest))
+            elif self.hashes.get(result) == csv_file:
+                # Same content as when this file was processed, only touched.
+                continue
+            elif result in self.hashes:
+                rows.append(self.record(dict(file=csv_file,
+                            status='Skipped: same content as ' + self.hashes[result]), result))
+            else:
+                self.hashes[result] = csv_file
+                future = self.pool.submit(process_file, csv_file, self.parameters, self.output_dir,
+                                          self.chunksize, self.fmt, self.columns)
+                self.pending[future] = ('process', csv_file, result)
+        return rows
+
+    def record(self, row, digest):
+        """Count a file done and append its row to the summary file.
+        """
+        size, mtime = self.handled.get(row['file'], (None, None))
+        row = dict(row, sha1=digest, size=size, mtime_ns=mtime)
+        if row['status'] == 'OK':
+            self.counts['processed'] += 1
+        elif row['status'].startswith('Skipped'):
+            self.counts['skipped'] += 1
+        else:
+            self.counts['failed'] += 1
+        header = not os.path.exists(self.summary_file)
+        pd.DataFrame([row], columns=self.summary_header).to_csv(
+            self.summary_file, sep='\t', decimal=',', index=False, header=header, mode='a')
+        return row
+
+    def idle(self):
+        """Whether no file is being written, waiting or processed.
+        """
+        return not (self.growing or self.waiting or self.pending)
+
+    def status(self):
+        """One line summary of the watch.
+        """
+        return ('%(processed)d processed, %(failed)d failed, %(skipped)d skipped' % self.counts
+                + ', %d waiting, %d in progress' % (len(self.waiting), len(self.pending)))
+
+    def run(self, interval=1.0, until_idle=False, report=None):
+        """Poll the directory until interrupted.
+
+        Args:
+            interval (float): Seconds between two polls.
+            until_idle (bool): Stop once all the files found are done.
+            report (callable): Called with each summary row.
+        """
+        try:
+            while True:
+                for row in self.poll():
+                    if report is not None:
+                        report(row)
+                if until_idle and self.idle():
+                    return
+                time.sleep(interval)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop the pool, cancelling the jobs not started. Files not done are
+        seen again by the next watch.
+        """
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        self.pending = {}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Process Apex3D files as they appear in a directory.')
+    parser.add_argument('directory', help='directory to watch')
+    parser.add_argument('-p', '--parameters',
+                        help='json file with the processing parameters')
+    parser.add_argument('-o', '--output-dir',
+                        help='directory for the results and the summary (default: DIRECTORY/CCS)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-c', '--chunksize', type=int, default=None,
+                        help='read files by chunks of this many lines, keeping only '
+                             'the columns and rows needed for processing')
+    parser.add_argument('-f', '--format', choices=list(export_formats), default='csv',
+                        help='format of the results (default: csv)')
+    parser.add_argument('--columns', nargs='+',
+                        help='columns of the results (default: all the columns)')
+    parser.add_argument('--settle', type=float, default=Apex3D_Watcher.default_settle,
+                        help='seconds without change after which a file is complete '
+                             '(default: %g)' % Apex3D_Watcher.default_settle)
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help='files handed to the workers at a time (default: number of jobs)')
+    parser.add_argument('-i', '--interval', type=float, default=1.0,
+                        help='seconds between two listings of the directory (default: 1)')
+    parser.add_argument('--until-idle', action='store_true',
+                        help='stop once the files found are processed')
+    args = parser.parse_args(argv)
+
+    watcher = Apex3D_Watcher(args.directory, read_param(args.parameters), args.output_dir,
+                             args.jobs, args.chunksize, args.format, args.columns,
+                             args.settle, args.max_pending)
+    def report(row):
+        print('%s: %s' % (row['file'], row['status']))
+        print('  ' + watcher.status())
+    print('Watching %s, results in %s' % (args.directory, watcher.output_dir))
+    try:
+        watcher.run(args.interval, args.until_idle, report)
+    except KeyboardInterrupt:
+        pass
+    print(watcher.status())
+    return 1 if watcher.counts['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())